@@ -0,0 +1,345 @@
+"""An in-process stand-in for the `nvim` object the plugin gets from the remote plugin host.
+It implements just enough of the API for the plugin to run against, every request going
+through its session's `request()` like with pynvim, so requests can be counted the same way for both.
+
+Windows are kept in a plain list in the order Neovim numbers them. That's enough to
+follow splits and `wincmd` moves along one line of windows, which is all the plugin does.
+"""
+
+
+class Session:
+    """Like pynvim's session, which every request goes through, whatever object it's made with
+    """
+
+    def __init__(self, nvim):
+        self.nvim = nvim
+
+    def request(self, name, *args):
+        self.nvim.requests += 1
+
+        return getattr(self.nvim, name)(*args)
+
+
+class RemoteMap:
+    """Like pynvim's `buffer.options`, `window.options` and `nvim.vars`
+    """
+
+    def __init__(self, nvim, get, set, obj=None):
+        self.nvim = nvim
+        self.get_name = get
+        self.set_name = set
+        self.obj = obj
+
+    def args(self, *args):
+        return ([self.obj] if self.obj is not None else []) + list(args)
+
+    def __getitem__(self, key):
+        return self.nvim._session.request(self.get_name, *self.args(key))
+
+    def __setitem__(self, key, value):
+        self.nvim._session.request(self.set_name, *self.args(key, value))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class Buffer:
+    def __init__(self, nvim, number, name=''):
+        self.nvim = nvim
+        self.number = self.handle = number
+        self.name = name
+        self.lines = ['']
+        self.local_options = {'buflisted': True, 'modifiable': True, 'buftype': '', 'bufhidden': ''}
+        self.options = RemoteMap(nvim, 'nvim_buf_get_option', 'nvim_buf_set_option', self)
+
+    def __iter__(self):
+        return iter(self.nvim._session.request('nvim_buf_get_lines', self, 0, -1, False))
+
+    def __len__(self):
+        return self.nvim._session.request('nvim_buf_line_count', self)
+
+
+class Window:
+    def __init__(self, nvim, handle, buffer):
+        self.nvim = nvim
+        self.handle = handle
+        self.buffer = buffer
+        self.cursor = [1, 0]
+        self.width = 80
+        self.height = 24
+        self.local_options = {}
+        self.options = RemoteMap(nvim, 'nvim_win_get_option', 'nvim_win_set_option', self)
+
+
+class Funcs:
+    def __init__(self, nvim):
+        self.nvim = nvim
+
+    def __getattr__(self, name):
+        return lambda *args: self.nvim.request('nvim_call_function', name, list(args))
+
+
+class Api:
+    def __init__(self, nvim):
+        self.nvim = nvim
+
+    def __getattr__(self, name):
+        return lambda *args: self.nvim.request('nvim_' + name, *args)
+
+
+class Current:
+    def __init__(self, nvim):
+        self.nvim = nvim
+
+    @property
+    def window(self):
+        return self.nvim._session.request('nvim_get_current_win')
+
+    @property
+    def buffer(self):
+        return self.nvim._session.request('nvim_get_current_buf')
+
+
+class FakeNvim:
+    """The `nvim` object. `requests` counts what the plugin has asked of it, `messages`
+    collects what it has written, and `inputs` are answers to `input()` prompts.
+    """
+
+    def __init__(self, columns=200, lines=50):
+        self.requests = 0
+        self.messages = []
+        self.inputs = []
+        self.pending = []
+        self.global_vars = {}
+
+        self._session = Session(self)
+
+        self.columns = columns
+        self.lines = lines
+
+        self.buffers_ = [Buffer(self, 1)]
+        self.next_handle = 1000
+        self.windows_ = [Window(self, self.next_handle, self.buffers_[0])]
+        self.current_window = self.windows_[0]
+
+        self.funcs = Funcs(self)
+        self.api = Api(self)
+        self.current = Current(self)
+        self.vars = RemoteMap(self, 'nvim_get_var', 'nvim_set_var')
+
+    # What pynvim does
+
+    def request(self, name, *args):
+        return self._session.request(name, *args)
+
+    def command(self, command):
+        return self.request('nvim_command', command)
+
+    def out_write(self, message):
+        return self.request('nvim_out_write', message)
+
+    def err_write(self, message):
+        return self.request('nvim_err_write', message)
+
+    def async_call(self, func, *args):
+        self.pending.append((func, args))
+
+    @property
+    def windows(self):
+        return self._session.request('nvim_list_wins')
+
+    @property
+    def buffers(self):
+        return self._session.request('nvim_list_bufs')
+
+    # For the benchmarks, none of these count as requests
+
+    def run_pending(self):
+        """Run what other threads have handed to `async_call()`, like the event loop would
+        """
+
+        while self.pending:
+            func, args = self.pending.pop(0)
+            func(*args)
+
+    def put_cursor(self, window, line):
+        """Move to `line` in `window`, like the user would
+        """
+
+        self.current_window = self.window(window)
+        self.current_window.cursor = [line, 0]
+
+    def window(self, window):
+        if isinstance(window, Window):
+            return window
+
+        for candidate in self.windows_:
+            if candidate.handle == window:
+                return candidate
+
+        raise KeyError(window)
+
+    # The API
+
+    def nvim_call_atomic(self, calls):
+        results = []
+        for i, (name, args) in enumerate(calls):
+            try:
+                # All in the one request
+                results.append(getattr(self, name)(*args))
+            except Exception as e:
+                return [results, [i, type(e).__name__, str(e)]]
+
+        return [results, None]
+
+    def nvim_get_var(self, name):
+        return self.global_vars[name]
+
+    def nvim_set_var(self, name, value):
+        self.global_vars[name] = value
+
+    def nvim_out_write(self, message):
+        self.messages.append(message)
+
+    def nvim_err_write(self, message):
+        self.messages.append(message)
+
+    def nvim_list_wins(self):
+        return list(self.windows_)
+
+    def nvim_list_bufs(self):
+        return list(self.buffers_)
+
+    def nvim_get_current_win(self):
+        return self.current_window
+
+    def nvim_set_current_win(self, window):
+        self.current_window = self.window(window)
+
+    def nvim_get_current_buf(self):
+        return self.current_window.buffer
+
+    def nvim_buf_get_option(self, buffer, name):
+        return buffer.local_options[name]
+
+    def nvim_buf_set_option(self, buffer, name, value):
+        buffer.local_options[name] = value
+
+    def nvim_win_get_option(self, window, name):
+        return self.window(window).local_options[name]
+
+    def nvim_win_set_option(self, window, name, value):
+        self.window(window).local_options[name] = value
+
+    def nvim_win_set_width(self, window, width):
+        self.window(window).width = width
+
+    def nvim_win_set_height(self, window, height):
+        self.window(window).height = height
+
+    def nvim_win_close(self, window, force):
+        window = self.window(window)
+        idx = self.windows_.index(window)
+        self.windows_.remove(window)
+
+        if self.current_window is window:
+            self.current_window = self.windows_[max(0, idx - 1)]
+
+    def nvim_buf_get_lines(self, buffer, start, end, strict):
+        return buffer.lines[start:None if end == -1 else end]
+
+    def nvim_buf_line_count(self, buffer):
+        return len(buffer.lines)
+
+    def nvim_buf_set_lines(self, buffer, start, end, strict, lines):
+        if not buffer.local_options['modifiable']:
+            raise RuntimeError('Buffer is not modifiable')
+
+        buffer.lines[start:None if end == -1 else end] = lines
+        if not buffer.lines:
+            buffer.lines = ['']
+
+    def nvim_call_function(self, name, args):
+        return getattr(self, 'function_' + name)(*args)
+
+    def nvim_command(self, command):
+        words = command.split()
+
+        if words[-1] in ('split', 'vsplit'):
+            window = Window(self, self.next_handle + 1, self.current_window.buffer)
+            self.next_handle += 1
+
+            idx = self.windows_.index(self.current_window)
+            self.windows_.insert(idx + 1 if words[0] == 'rightbelow' else idx, window)
+            self.current_window = window
+        elif words[0] == 'edit':
+            for buffer in self.buffers_:
+                if buffer.name == words[1]:
+                    break
+            else:
+                buffer = Buffer(self, len(self.buffers_) + 1, words[1])
+                self.buffers_.append(buffer)
+
+            self.current_window.buffer = buffer
+        elif words[-1] == 'w' and words[-2] == 'wincmd':
+            idx = self.windows_.index(self.current_window)
+            if len(words) == 3:
+                idx = int(words[0]) - 1
+            else:
+                idx = (idx + 1) % len(self.windows_)
+
+            self.current_window = self.windows_[idx]
+        elif words[0] == 'wincmd':
+            idx = self.windows_.index(self.current_window)
+            idx += 1 if words[1] in ('l', 'j') else -1
+            self.current_window = self.windows_[max(0, min(idx, len(self.windows_) - 1))]
+        elif words[0] == 'resize':
+            self.current_window.height = int(words[1])
+        elif words[:2] == ['vertical', 'resize']:
+            self.current_window.width = int(words[2])
+        elif words[0] == 'bdelete!':
+            number = int(words[1])
+            self.buffers_ = [buffer for buffer in self.buffers_ if buffer.number != number] or [Buffer(self, 1)]
+            for window in self.windows_:
+                if window.buffer.number == number:
+                    window.buffer = self.buffers_[0]
+        elif words[0] in ('setlocal', 'nmap', 'xmap', 'echom', 'copen', 'cclose'):
+            pass
+        else:
+            raise RuntimeError('Not implemented: {}'.format(command))
+
+    # Vim functions
+
+    def function_input(self, prompt):
+        return self.inputs.pop(0) if self.inputs else ''
+
+    def function_getpos(self, expr):
+        line, col = self.current_window.cursor
+        return [0, line, col + 1, 0]
+
+    def function_setpos(self, expr, pos):
+        self.current_window.cursor = [pos[1], pos[2] - 1]
+
+    def function_cursor(self, line, col):
+        line = max(1, min(line, len(self.current_window.buffer.lines)))
+        self.current_window.cursor = [line, max(0, col - 1)]
+
+    def function_win_getid(self):
+        return self.current_window.handle
+
+    def function_win_gotoid(self, handle):
+        try:
+            self.current_window = self.window(handle)
+        except KeyError:
+            return 0
+
+        return 1
+
+    def function_expand(self, expr):
+        return self.current_window.buffer.name
+
+    def function_setqflist(self, *args):
+        return 0
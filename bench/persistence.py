@@ -0,0 +1,85 @@
+"""Compare the ways of loading and saving the scene list at different sizes:
+plain PyYAML as the plugin used to, the libyaml backed `yaml_load()` and
+`yaml_dump()`, and the JSON sidecar.
+
+    python bench/persistence.py [--sizes 100,1000,10000] [--runs N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'rplugin', 'python3'))
+
+import yaml  # noqa: E402
+
+import snowflake  # noqa: E402
+
+
+def make_scenes(count):
+    """Return a scene list of `count` scenes
+    """
+
+    return [OrderedDict((
+        ('title', 'Scene {} where something happens'.format(i)),
+        ('descr', 'Somebody goes somewhere and finds out something they did not know about scene {}'.format(i)),
+        ('filename', os.path.join(snowflake.SNOWFLAKE_SCENES_DIR, '{}.rst'.format(uuid.uuid4()))),
+    )) for i in range(count)]
+
+
+def best_of(runs, func, *args):
+    """Return the best time of `runs` calls of `func(*args)`, in milliseconds
+    """
+
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return 1000 * best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print('libyaml: {}'.format('yes' if hasattr(yaml, 'CSafeLoader') else 'no'))
+    print('{:>8} {:>24} {:>10} {:>10}'.format('scenes', 'method', 'load ms', 'dump ms'))
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        scenes = make_scenes(size)
+
+        plain = yaml.dump(scenes)
+        fast = snowflake.yaml_dump(scenes)
+        sidecar = json.dumps({
+            'yaml': [0, 0],
+            'scenes': [[scene['title'], scene['descr'], scene['filename']] for scene in scenes],
+        })
+
+        results = (
+            ('yaml.load/dump', best_of(args.runs, yaml.load, plain, yaml.Loader),
+                               best_of(args.runs, yaml.dump, scenes)),
+            ('yaml_load/yaml_dump', best_of(args.runs, snowflake.yaml_load, fast),
+                                    best_of(args.runs, snowflake.yaml_dump, scenes)),
+            ('json sidecar', best_of(args.runs, lambda: [OrderedDict(zip(('title', 'descr', 'filename'), scene))
+                                                         for scene in json.loads(sidecar)['scenes']]),
+                             best_of(args.runs, json.dumps, json.loads(sidecar))),
+        )
+
+        for method, load_ms, dump_ms in results:
+            print('{:>8} {:>24} {:>10.2f} {:>10.2f}'.format(size, method, load_ms, dump_ms))
+
+
+if __name__ == '__main__':
+    main()
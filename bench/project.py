@@ -0,0 +1,105 @@
+"""Generate a synthetic Snowflake project to benchmark against: the snowflake files,
+the scene files and the scene list in chapters, with text of roughly the size real ones have.
+
+    python bench/project.py DIRECTORY [--scenes N] [--seed N]
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'rplugin', 'python3'))
+
+import snowflake  # noqa: E402
+
+WORDS = (
+    'the a she he they it was had said door night window road letter house old her his their '
+    'into over under through before after again never always still only just quite rather '
+    'looked walked turned waited remembered thought knew wanted found opened closed kept '
+    'rain light dark morning evening voice hand face room table chair street town river '
+    'quiet cold warm slow long small strange certain last first other same own'
+).split()
+
+# Words per scene and per paragraph, about what a novel has
+SCENE_WORDS = (500, 3000)
+CHAPTER_SCENES = 20
+PARAGRAPH_WORDS = (20, 120)
+
+
+def make_text(rng, words):
+    """Return about `words` words of text in paragraphs, wrapped like people wrap RST
+    """
+
+    paragraphs = []
+    while words > 0:
+        count = min(words, rng.randint(*PARAGRAPH_WORDS))
+        words -= count
+
+        text = ' '.join(rng.choice(WORDS) for i in range(count)).capitalize() + '.'
+
+        lines = []
+        line = []
+        for word in text.split():
+            line.append(word)
+            if sum(len(w) + 1 for w in line) > 72:
+                lines.append(' '.join(line))
+                line = []
+
+        if line:
+            lines.append(' '.join(line))
+
+        paragraphs.append('\n'.join(lines))
+
+    return '\n\n'.join(paragraphs) + '\n'
+
+
+def generate(directory, scenes, seed=0):
+    """Write a project with `scenes` scenes into `directory`, the same one every time for the same seed
+    """
+
+    rng = random.Random(seed)
+
+    for subdirectory in (snowflake.SNOWFLAKE_RST_DIR, snowflake.SNOWFLAKE_SCENES_DIR, snowflake.SNOWFLAKE_OUT_DIR):
+        os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+    for key, filename in snowflake.SnowflakeManager.snowflake_files.items():
+        words = {'one-line': 20, 'one-paragraph': 100, 'one-page': 500, 'synopsis': 2000}[key]
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(make_text(rng, words).encode('utf-8'))
+
+    scene_list = []
+    for i in range(scenes):
+        if i % CHAPTER_SCENES == 0:
+            scene_list.append(snowflake.Chapter('Chapter {}'.format(i // CHAPTER_SCENES + 1)))
+
+        filename = os.path.join(snowflake.SNOWFLAKE_SCENES_DIR, 'scene-{:05}.rst'.format(i))
+        title = 'Scene {} {}'.format(i, rng.choice(WORDS))
+        descr = make_text(rng, 12).strip()
+
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write('.. {}\n.. {}\n\n'.format(title, descr).encode('utf-8'))
+            f.write(make_text(rng, rng.randint(*SCENE_WORDS)).encode('utf-8'))
+
+        scene_list.append(snowflake.Scene(title, descr, filename))
+
+    with open(os.path.join(directory, snowflake.SNOWFLAKE_SCENES_YAML), 'wb') as f:
+        f.write(snowflake.yaml_dump(scene_list))
+
+    info = {'info': {'name': 'bench', 'author': 'Bench Mark', 'copyright-year': 2000}}
+    with open(os.path.join(directory, snowflake.SNOWFLAKE_YAML), 'wb') as f:
+        f.write(snowflake.yaml_dump(info))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('directory')
+    parser.add_argument('--scenes', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.directory, args.scenes, args.seed)
+
+
+if __name__ == '__main__':
+    main()
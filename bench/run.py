@@ -0,0 +1,301 @@
+"""Run the plugin through what a writer does with it on synthetic projects of different sizes,
+timing each step and counting the requests it makes to Neovim.
+
+    python bench/run.py [--sizes 10,100,1000] [--runs N] [--nvim] [--save FILE] [--compare FILE]
+
+By default the plugin talks to the in-process stand-in in `fakenvim.py`, so what is timed
+is the plugin alone. With `--nvim`, it talks to a headless `nvim --embed` instead.
+Save the results of one commit and compare another one against them to spot regressions.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, 'rplugin', 'python3'))
+
+import snowflake  # noqa: E402
+
+import fakenvim  # noqa: E402
+import project  # noqa: E402
+
+# How much slower than before something has to be to call it a regression, and by how
+# many milliseconds at least, as timing anything quicker than that is mostly noise
+REGRESSION = 1.2
+NOISE_MS = 0.5
+
+
+class StubConverter:
+    """Stands in for `snowflake.Converter`, producing empty documents right away
+    """
+
+    def submit(self, path, parts=None, formats=('odt',)):
+        for fmt in formats:
+            with open(snowflake.converted_path(path, fmt), 'wb'):
+                pass
+
+        future = concurrent.futures.Future()
+        future.set_result(None)
+
+        return future
+
+    def reset(self):
+        pass
+
+
+class Session:
+    """The plugin and the Neovim it talks to, with the requests it makes counted
+    """
+
+    def __init__(self, embed):
+        if embed:
+            import neovim
+
+            self.nvim = neovim.attach('child', argv=['nvim', '--embed', '--headless', '-u', 'NONE', '-i', 'NONE'])
+        else:
+            self.nvim = fakenvim.FakeNvim()
+
+        self.embed = embed
+        self.requests = 0
+
+        # Like the profiler, counting at the session catches the requests of buffers, windows and the like too
+        session = self.nvim._session
+        request = session.request
+
+        def count_request(*args, **kwargs):
+            self.requests += 1
+            return request(*args, **kwargs)
+
+        session.request = count_request
+
+        self.plugin = snowflake.SnowflakePlugin(self.nvim)
+        self.plugin.converter = StubConverter()
+
+    def put_cursor(self, line):
+        """Go to `line` of the menu, like the user would, which the plugin isn't charged for
+        """
+
+        if self.embed:
+            requests = self.requests
+            self.nvim.api.set_current_win(self.plugin.menu_win_handle)
+            self.nvim.api.win_set_cursor(self.plugin.menu_win_handle, [line, 0])
+            self.requests = requests
+        else:
+            self.nvim.put_cursor(self.plugin.menu_win_handle, line)
+
+    def run_pending(self):
+        """Run what the plugin has handed to `async_call()`. A real Neovim's event loop
+        already does that whenever it gets to it.
+        """
+
+        if not self.embed:
+            self.nvim.run_pending()
+
+    def menu_line(self, manager, idx, kind):
+        return self.plugin.menu_items.index(snowflake.MenuItem(self.plugin.managers[manager], idx, kind)) + 1
+
+    def close(self):
+        self.plugin.on_vimleavepre_flush()
+
+        if self.embed:
+            self.nvim.close()
+
+
+def measure(session, func, *args):
+    """Return the milliseconds and requests of `func(*args)`
+    """
+
+    requests = session.requests
+    start = time.perf_counter()
+    func(*args)
+
+    return 1000 * (time.perf_counter() - start), session.requests - requests
+
+
+def best_of(runs, session, func, *args):
+    """Return `measure()` of the fastest of `runs` calls
+    """
+
+    return min(measure(session, func, *args) for i in range(runs))
+
+
+def per_op(count, session, func, *args):
+    """Return `measure()` of `count` calls, divided by `count`
+    """
+
+    elapsed, requests = measure(session, lambda: [func(*args) for i in range(count)])
+
+    return elapsed / count, requests / count
+
+
+def run_size(size, runs, embed):
+    """Benchmark a generated project of `size` scenes, return {step: (ms, requests)}
+    """
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        project.generate(directory, size)
+
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            # Nothing cached yet, then everything is
+            for step in ('startup (cold)', 'startup (warm)'):
+                session = Session(embed)
+                results[step] = measure(session, session.plugin.init_snowflake, [], '')
+                if step.endswith('(cold)'):
+                    session.close()
+
+            plugin = session.plugin
+            scenes = plugin.managers['scene']
+
+            results['refresh_scenes'] = best_of(runs, session, scenes.refresh_scenes)
+
+            # The scene in the middle of the book, and its chapter
+            middle_idx = [i for i, scene in enumerate(scenes.scenes) if scene.filename is not None][size // 2]
+            middle = scenes.scenes[middle_idx].filename
+            with open(middle, 'ab') as f:
+                f.write(b'\nAnd then some more happened.\n')
+            results['refresh_files (1 written)'] = measure(
+                session, lambda: (plugin.refresh_files({middle}), session.run_pending()))
+
+            # Open up the scenes in the menu
+            session.put_cursor(session.menu_line('scene', None, 'header'))
+            results['toggle_menu (expand)'] = measure(session, plugin.toggle_menu, [])
+
+            session.put_cursor(session.menu_line('scene', scenes.scenes.chapter_of(middle_idx), 'chapter'))
+            results['toggle_menu (chapter)'] = measure(session, plugin.toggle_menu, [])
+
+            def redraw():
+                plugin.menu_items = [snowflake.MenuItem(None, None, None)]
+                plugin.menu_lines = ['']
+                plugin.update_menu()
+
+            results['update_menu (full)'] = best_of(runs, session, redraw)
+            results['update_menu (unchanged)'] = best_of(runs, session, plugin.update_menu)
+
+            line = session.menu_line('scene', middle_idx, 'title')
+            session.put_cursor(line)
+            results['menu_stat'] = best_of(runs, session, plugin.menu_stat)
+
+            results['search'] = best_of(runs, session, plugin.search, [scenes.scenes[middle_idx].title])
+
+            def edit():
+                session.put_cursor(line)
+                plugin.edit_scene([])
+
+            results['edit_scene'] = best_of(runs, session, edit)
+
+            session.put_cursor(line)
+            results['move_scene (per move)'] = per_op(10, session, plugin.move_scene, [1])
+
+            # Ten scenes selected in the menu
+            first = session.menu_line('scene', middle_idx, 'title')
+            results['move_scenes (10, per move)'] = per_op(10, session, plugin.move_scenes, [1], [first, first + 19])
+
+            if not embed:
+                # A real one would wait for someone to answer the prompts
+                session.put_cursor(session.menu_line('scene', middle_idx, 'title'))
+                session.nvim.inputs = ['Added', 'Added to benchmark'] * 10
+                results['append_scene (per scene)'] = per_op(10, session, plugin.append_scene, [])
+
+            for step in ('run_build (full)', 'run_build (up to date)'):
+                plugin.build_lock.acquire()
+                results[step] = measure(session, lambda: (plugin.run_build(), session.run_pending()))
+
+            session.close()
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+def git_commit():
+    """Return the commit being benchmarked, if there is one
+    """
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--nvim', action='store_true', help='run against nvim --embed')
+    parser.add_argument('--save', metavar='FILE', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='compare with results saved before')
+    args = parser.parse_args()
+
+    if args.nvim and shutil.which('nvim') is None:
+        print('nvim not found')
+        return 1
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    before = None
+    if args.compare:
+        with open(args.compare, 'rb') as f:
+            before = json.loads(f.read().decode('utf-8'))
+
+    results = {}
+    for size in sizes:
+        for step, (elapsed, requests) in run_size(size, args.runs, args.nvim).items():
+            results.setdefault(step, {})[str(size)] = {'ms': elapsed, 'requests': requests}
+
+    print('{} on {}, {}'.format(git_commit() or 'unknown commit', 'nvim' if args.nvim else 'fake nvim',
+                                'ms and requests per step by number of scenes'))
+    print('{:<28}'.format('step') + ''.join('{:>22}'.format(size) for size in sizes))
+
+    regressions = 0
+    for step, by_size in results.items():
+        cells = []
+        for size in sizes:
+            result = by_size.get(str(size))
+            if result is None:
+                cells.append('{:>22}'.format('-'))
+                continue
+
+            cell = '{:.2f} / {:g}'.format(result['ms'], round(result['requests'], 1))
+
+            old = before['results'].get(step, {}).get(str(size)) if before is not None else None
+            if old is not None and old['ms'] > 0:
+                ratio = result['ms'] / old['ms']
+                slower = (ratio > REGRESSION and result['ms'] - old['ms'] > NOISE_MS) or \
+                    result['requests'] > old['requests']
+                regressions += slower
+                cell = '{}{} {:+.0%}'.format('!' if slower else '', cell, ratio - 1)
+
+            cells.append('{:>22}'.format(cell))
+
+        print('{:<28}'.format(step) + ''.join(cells))
+
+    if before is not None:
+        print('{} regressions against {} (marked with !)'.format(regressions, before.get('commit') or args.compare))
+
+    if args.save:
+        with open(args.save, 'wb') as f:
+            f.write(json.dumps({
+                'commit': git_commit(),
+                'nvim': 'nvim' if args.nvim else 'fake',
+                'python': platform.python_version(),
+                'results': results,
+            }, indent=2).encode('utf-8'))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""Compare the scene list the plugin used to keep, a plain list of `OrderedDict`s,
+with `SceneList` of `Scene`s: memory and the operations the plugin does on it.
+
+    python bench/scenes.py [--sizes 10000,50000] [--runs N]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'rplugin', 'python3'))
+
+import snowflake  # noqa: E402
+
+OPERATIONS = 1000
+
+
+def make_rows(count):
+    """Return `count` (title, descr, filename) tuples
+    """
+
+    return [(
+        'Scene {} where something happens'.format(i),
+        'Somebody goes somewhere and finds out something they did not know about scene {}'.format(i),
+        os.path.join(snowflake.SNOWFLAKE_SCENES_DIR, '{}.rst'.format(uuid.uuid4())),
+    ) for i in range(count)]
+
+
+def build_dicts(rows):
+    return [OrderedDict((('title', title), ('descr', descr), ('filename', filename)))
+            for title, descr, filename in rows]
+
+
+def build_scenes(rows):
+    return snowflake.SceneList(snowflake.Scene(title, descr, filename) for title, descr, filename in rows)
+
+
+def lookup_dicts(scenes, filenames):
+    for filename in filenames:
+        for idx, scene in enumerate(scenes):
+            if scene['filename'] == filename:
+                break
+
+
+def lookup_scenes(scenes, filenames):
+    for filename in filenames:
+        scenes.position(filename)
+
+
+def move_dicts(scenes, filenames):
+    # What :SnowflakeMoveScene needs: find the scene, then move it a step
+    for filename in filenames:
+        idx = next(i for i, scene in enumerate(scenes) if scene['filename'] == filename)
+        scenes.insert(idx + 1, scenes.pop(idx))
+
+
+def move_scenes(scenes, filenames):
+    for filename in filenames:
+        idx = scenes.position(filename)
+        scenes.move(idx, idx + 1)
+
+
+def insert_dicts(scenes, rows):
+    for title, descr, filename in rows:
+        scenes.insert(len(scenes) // 2, OrderedDict((('title', title), ('descr', descr), ('filename', filename))))
+
+
+def insert_scenes(scenes, rows):
+    for title, descr, filename in rows:
+        scenes.insert(len(scenes) // 2, snowflake.Scene(title, descr, filename))
+
+
+def timed(func, *args):
+    """Return how long `func(*args)` took, in milliseconds
+    """
+
+    start = time.perf_counter()
+    func(*args)
+
+    return 1000 * (time.perf_counter() - start)
+
+
+def memory(build, rows):
+    """Return the bytes allocated by `build(rows)`
+    """
+
+    tracemalloc.start()
+    scenes = build(rows)  # noqa: F841
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10000,50000')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{} lookups, moves and inserts each'.format(OPERATIONS))
+    print('{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'scenes', 'kind', 'memory kB', 'build ms', 'lookup ms', 'move ms', 'insert ms'))
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        rows = make_rows(size)
+        extra = make_rows(OPERATIONS)
+
+        # Spread over the whole list, the way a writer jumps around in it
+        step = max(1, size // OPERATIONS)
+        targets = [rows[i][2] for i in range(0, size - 1, step)][:OPERATIONS]
+
+        for kind, build, lookup, move, insert in (
+                ('dicts', build_dicts, lookup_dicts, move_dicts, insert_dicts),
+                ('SceneList', build_scenes, lookup_scenes, move_scenes, insert_scenes)):
+            results = [[], [], [], []]
+            for i in range(args.runs):
+                results[0].append(timed(build, rows))
+
+                scenes = build(rows)
+                results[1].append(timed(lookup, scenes, targets))
+                results[2].append(timed(move, scenes, targets))
+                results[3].append(timed(insert, scenes, extra))
+
+            print('{:>8} {:>10} {:>10.0f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                size, kind, memory(build, rows) / 1024, *(min(result) for result in results)))
+
+
+if __name__ == '__main__':
+    main()
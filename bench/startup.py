@@ -0,0 +1,86 @@
+"""Measure what the plugin adds to Neovim's startup: importing the module and
+constructing `SnowflakePlugin`, which the remote plugin host does in every session.
+
+    python bench/startup.py [--runs N]
+
+Each run happens in a fresh interpreter, in an empty directory that must stay
+empty, against a stand-in for `nvim` that counts what the plugin asks of it.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'rplugin', 'python3')
+
+RUN = '''
+import sys
+import time
+
+import neovim
+
+sys.path.insert(0, {plugin_dir!r})
+
+
+class Recorder(object):
+    touched = 0
+
+    def __getattr__(self, name):
+        Recorder.touched += 1
+        return self
+
+
+start = time.perf_counter()
+import snowflake
+imported = time.perf_counter()
+snowflake.SnowflakePlugin(Recorder())
+constructed = time.perf_counter()
+
+print(imported - start, constructed - imported, Recorder.touched)
+'''
+
+
+def run_once(project_dir):
+    """Return (import seconds, construction seconds, nvim accesses) of one fresh run
+    """
+
+    out = subprocess.check_output([sys.executable, '-c', RUN.format(plugin_dir=PLUGIN_DIR)], cwd=project_dir)
+    imported, constructed, touched = out.split()
+
+    return float(imported), float(constructed), int(touched)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    imports = []
+    constructions = []
+    with tempfile.TemporaryDirectory() as project_dir:
+        for i in range(args.runs):
+            imported, constructed, touched = run_once(project_dir)
+
+            imports.append(imported)
+            constructions.append(constructed)
+
+            if touched:
+                print('SnowflakePlugin() made {} nvim accesses'.format(touched))
+
+            if os.listdir(project_dir):
+                print('SnowflakePlugin() created {}'.format(', '.join(os.listdir(project_dir))))
+                return 1
+
+    print('import snowflake:  median {:.2f} ms, max {:.2f} ms'.format(
+        1000 * statistics.median(imports), 1000 * max(imports)))
+    print('SnowflakePlugin(): median {:.3f} ms, max {:.3f} ms'.format(
+        1000 * statistics.median(constructions), 1000 * max(constructions)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
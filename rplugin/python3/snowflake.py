@@ -1,24 +1,1854 @@
 import abc
+import bisect
+import concurrent.futures
+import functools
+import hashlib
+import importlib.util
+import json
 import neovim
 import os
+import re
+import shutil
 import subprocess
-import uuid
-import yaml
+import threading
+import time
 
 from collections import OrderedDict
+from collections import deque
 from collections import namedtuple
 
-MenuStat = namedtuple('MenuStat', ('manager', 'offset', 'line', 'col'))
+# What a menu line shows: the manager, index of the item in that manager, and the kind of line.
+# The lines above the managers' have no manager, and their index is their line.
+MenuItem = namedtuple('MenuItem', ('manager', 'idx', 'kind'))
+MENU_HEADER = ('MENU', '====', '')
+MenuStat = namedtuple('MenuStat', ('manager', 'idx', 'kind', 'line', 'col'))
+
+# Window layouts are trees of splits with a file in every pane. A pane's size is its width
+# when its split is vertical, ie. side by side, and its height otherwise, None to leave it be.
+# Options are given to `setlocal` as they are.
+Pane = namedtuple('Pane', ('filename', 'size', 'options'))
+Split = namedtuple('Split', ('vertical', 'children'))
 
 SNOWFLAKE_YAML = 'snowflake.yaml'
 SNOWFLAKE_RST_DIR = 'snowflake-files'
 SNOWFLAKE_SCENES_YAML = 'snowflake-scenes.yaml'
+SNOWFLAKE_SCENES_JOURNAL = 'snowflake-scenes.journal'
 SNOWFLAKE_SCENES_DIR = 'snowflake-scenes'
 SNOWFLAKE_OUT_DIR = 'out'
 SNOWFLAKE_ONE_DOCS_FILE = 'one-docs.rst'
+SNOWFLAKE_BUILD_MANIFEST = os.path.join(SNOWFLAKE_OUT_DIR, 'build-manifest.json')
+SNOWFLAKE_CACHE_DIR = '.snowflake-cache'
+SNOWFLAKE_FILE_CACHE = os.path.join(SNOWFLAKE_CACHE_DIR, 'files.json')
+SNOWFLAKE_SCENES_SIDECAR = os.path.join(SNOWFLAKE_CACHE_DIR, 'scenes.json')
+SNOWFLAKE_SESSION_LOG = 'snowflake-session.log'
+SNOWFLAKE_SESSION_STATS = os.path.join(SNOWFLAKE_CACHE_DIR, 'session-stats.json')
+SNOWFLAKE_PROFILE = os.path.join(SNOWFLAKE_CACHE_DIR, 'profile-{}.txt')
+SNOWFLAKE_SEARCH_INDEX = os.path.join(SNOWFLAKE_CACHE_DIR, 'search.json')
+# Pickles are only ever loaded from the user's own cache, never from a project someone else may have made
+SNOWFLAKE_USER_CACHE_DIR = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+SNOWFLAKE_DOCTREES_DIR = os.path.join(SNOWFLAKE_USER_CACHE_DIR, 'snowflake.nvim', 'doctrees')
+
+# Seconds of quiet before refreshing written scenes, and before saving the scene list
+REFRESH_DELAY = 0.2
+SAVE_DELAY = 2.0
+
+# Seconds of quiet after writing files before rebuilding, with `:SnowflakeBuildWatch`
+BUILD_WATCH_DELAY = 1.0
+
+# Seconds of quiet before appending what happened to the session log
+LOG_DELAY = 5.0
+
+# Seconds between looks at the project when the watcher can't be told about changes
+WATCH_POLL_INTERVAL = 2.0
+
+# Menu lines are only rendered around what's visible: how many lines are assumed visible until
+# Neovim says, and how many more to render above and below them
+MENU_PAGE = 100
+MENU_MARGIN = 50
+
+# How many of the latest calls of each handler the profiler keeps, and its wall time buckets in ms
+PROFILE_SAMPLES = 500
+PROFILE_BUCKETS = (1, 4, 16, 64, 256)
+
+# XXX: Just assume this exists
+CONVERSION = ('/usr/bin/rst2odt', '.odt')
+
+# How much to read at a time when streaming files around
+COPY_CHUNK_SIZE = 65536
+
+# Preferably convert with docutils in worker processes, rather than running `CONVERSION`.
+# What can be built: the docutils writer and the file extension of each format.
+BUILD_FORMATS = OrderedDict((
+    ('odt', ('odf_odt', '.odt')),
+    ('html', ('html', '.html')),
+    ('latex', ('latex', '.tex')),
+))
+
+# Warnings are collected from the doctree rather than written out, see `publish()`
+DOCUTILS_SETTINGS = {'doctitle_xform': False, 'warning_stream': False}
+
+# How many of the warnings docutils has about a document to show
+BUILD_MESSAGES = 10
+
+# Seconds a cached doctree is kept without being used
+DOCTREE_MAX_AGE = 30 * 24 * 3600
+
+# Explicit markup that starts like a comment but isn't one: targets, footnotes, substitutions, directives
+RST_NOT_COMMENT = re.compile(r'\.\.\s+([_\[|]|[\w.+:-]+?::(\s|$))')
+
+# A transition, a line of at least 4 of the same punctuation character
+RST_TRANSITION = re.compile(r'([!-/:-@[-`{-~])\1{3,}')
+
+# What `:SnowflakeSearch` searches for, in lower case
+SEARCH_WORD = re.compile(r'\w+')
+
+
+def normalize_path(path):
+    """Make `path` comparable with the relative file names in the scene list
+    """
+
+    return os.path.normpath(os.path.relpath(os.path.abspath(path)))
+
+
+def call_atomic(nvim, calls):
+    """Issue `calls`, a list of (api function, args) pairs, as a single RPC
+    """
+
+    results, error = nvim.api.call_atomic(calls)
+
+    if error is not None:
+        idx, _, msg = error
+        raise RuntimeError('{} failed: {}'.format(calls[idx][0], msg))
+
+    return results
+
+
+def layout_calls(node, vertical=False):
+    """Return the calls that turn the current window into the panes of `node`, and
+    the calls that size those panes once they all exist
+    """
+
+    if isinstance(node, Pane):
+        calls = [('nvim_command', ['edit {}'.format(node.filename)])]
+        if node.options:
+            calls.append(('nvim_command', ['setlocal {}'.format(node.options)]))
+
+        sizes = [('nvim_command', ['wincmd w'])]
+        if node.size is not None:
+            sizes.append(('nvim_command', ['{}resize {}'.format('vertical ' if vertical else '', node.size)]))
+
+        return calls, sizes
+
+    # Splitting above or left keeps the new window current, so after all the splits
+    # we're in the first child and the rest follow in order
+    split = 'leftabove vsplit' if node.vertical else 'leftabove split'
+    calls = [('nvim_command', [split])] * (len(node.children) - 1)
+    sizes = []
+
+    for i, child in enumerate(node.children):
+        if i:
+            # Wherever the previous child left us, its next sibling is still one window
+            calls.append(('nvim_command', ['wincmd l' if node.vertical else 'wincmd j']))
+
+        child_calls, child_sizes = layout_calls(child, node.vertical)
+        calls.extend(child_calls)
+        sizes.extend(child_sizes)
+
+    return calls, sizes
+
+
+def apply_layout(nvim, menu_win_handle, layout):
+    """Lay out the window right of the menu as `layout` says in one go, ending up in its first pane
+    """
+
+    calls, sizes = layout_calls(layout)
+
+    # Windows are numbered in the order the tree lists them, so from the menu `wincmd w`
+    # visits the panes in order for sizing. Sizes are only set when every split is done,
+    # as splitting evens them out.
+    back = ('nvim_call_function', ['win_gotoid', [menu_win_handle]])
+    call_atomic(nvim, [back, ('nvim_command', ['wincmd l'])] + calls + [back] + sizes + [
+        back,
+        ('nvim_command', ['wincmd w']),
+    ])
+
+
+def diff_lines(old, new):
+    """Return the hunks that turn `old` into `new` as (start, end, new start, new end),
+    bottom first so they can be applied in order without shifting each other.
+    `old[start:end]` is to be replaced with `new[new start:new end]`.
+    """
+
+    import difflib
+
+    # Cheaply trim what's common at both ends, usually leaving one small hunk
+    head = 0
+    while head < len(old) and head < len(new) and old[head] == new[head]:
+        head += 1
+
+    tail = 0
+    limit = min(len(old), len(new)) - head
+    while tail < limit and old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+
+    matcher = difflib.SequenceMatcher(None, old[head:len(old) - tail], new[head:len(new) - tail])
+
+    hunks = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            hunks.append((head + i1, head + i2, head + j1, head + j2))
+
+    hunks.reverse()
+
+    return hunks
+
+
+def write_atomic(path, data, sync=False):
+    """Write `data` to `path` so that it's either all there or not at all.
+    With `sync`, also make sure it's on disk before replacing the old file.
+    """
+
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+def make_cache_dir():
+    """Create the project's cache directory unless it's there already, whichever thread gets to it first
+    """
+
+    os.makedirs(SNOWFLAKE_CACHE_DIR, exist_ok=True)
+
+
+@functools.lru_cache()
+def yaml_support():
+    """Return the fastest safe YAML (loader, dumper) available, taught about OrderedDicts
+    """
+
+    import yaml
+
+    class Loader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+        pass
+
+    class Dumper(getattr(yaml, 'CSafeDumper', yaml.SafeDumper)):
+        pass
+
+    def construct_ordereddict(loader, node):
+        # Older versions let yaml.dump() write these as a python object
+        if isinstance(node, yaml.MappingNode):
+            state = loader.construct_mapping(node, deep=True)
+            args = state.get('args', [])
+            items = state.get('dictitems', {}).items()
+        else:
+            args = loader.construct_sequence(node, deep=True)
+            items = ()
+
+        ordered = OrderedDict(args[0] if args else ())
+        ordered.update(items)
+
+        return ordered
+
+    Loader.add_constructor('tag:yaml.org,2002:python/object/apply:collections.OrderedDict', construct_ordereddict)
+    Dumper.add_representer(OrderedDict, lambda dumper, data: dumper.represent_dict(data))
+    Dumper.add_representer(Scene, lambda dumper, data: dumper.represent_dict(data.to_dict()))
+    Dumper.add_representer(Chapter, lambda dumper, data: dumper.represent_dict(data.to_dict()))
+    Dumper.add_representer(SceneList, lambda dumper, data: dumper.represent_list(list(data)))
+
+    return Loader, Dumper
+
+
+def yaml_load(data):
+    """Parse our YAML metadata
+    """
+
+    import yaml
+
+    return yaml.load(data, Loader=yaml_support()[0])
+
+
+def yaml_dump(obj):
+    """Serialize our YAML metadata, keeping the order of things
+    """
+
+    import yaml
+
+    return yaml.dump(obj, Dumper=yaml_support()[1], sort_keys=False, default_flow_style=False).encode('utf-8')
+
+
+def converted_path(path, fmt='odt'):
+    """Where converting `path` to `fmt` puts the result
+    """
+
+    return path.rsplit('.', 1)[0] + BUILD_FORMATS[fmt][1]
+
+
+def copy_into(out_f, path):
+    """Append the contents of `path` to `out_f` without reading it all into memory,
+    letting the kernel do the copying where it can. Return how many bytes were copied.
+    """
+
+    with open(path, 'rb') as in_f:
+        if hasattr(os, 'sendfile'):
+            out_f.flush()
+
+            offset = 0
+            size = os.fstat(in_f.fileno()).st_size
+            try:
+                while offset < size:
+                    sent = os.sendfile(out_f.fileno(), in_f.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+            except OSError:
+                # Not supported for these files, copy the rest by hand
+                pass
+
+            in_f.seek(offset)
+
+        shutil.copyfileobj(in_f, out_f, COPY_CHUNK_SIZE)
+
+        return in_f.tell()
+
+
+def copy_stripped(out_f, path):
+    """Like `copy_into()`, but leave out leading and trailing whitespace like `bytes.strip()`
+    """
+
+    started = False
+    # Whitespace that will only be written if something follows it
+    pending = b''
+
+    with open(path, 'rb') as in_f:
+        for chunk in iter(lambda: in_f.read(COPY_CHUNK_SIZE), b''):
+            if not started:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                started = True
+
+            text = chunk.rstrip()
+            if text:
+                out_f.write(pending)
+                out_f.write(text)
+                pending = chunk[len(text):]
+            else:
+                pending += chunk
+
+
+def starts_comment(text):
+    """Return True if the RST line `text` starts a comment
+    """
+
+    return text.startswith('..') and (len(text) == 2 or text[2].isspace()) and not RST_NOT_COMMENT.match(text)
+
+
+def count_text(lines):
+    """Return the (words, characters, paragraphs) in RST `lines` of bytes, leaving out comments.
+    Characters don't include indentation or line breaks.
+    """
+
+    words = chars = paragraphs = 0
+
+    in_comment = False
+    in_paragraph = False
+
+    for line in lines:
+        text = line.decode('utf-8', 'replace').rstrip()
+
+        if not text:
+            # Comments go on over blank lines, as long as what follows is indented
+            in_paragraph = False
+            continue
+
+        if in_comment and text[0].isspace():
+            continue
+
+        in_comment = starts_comment(text)
+        if in_comment:
+            in_paragraph = False
+            continue
+
+        if not in_paragraph:
+            paragraphs += 1
+            in_paragraph = True
+
+        words += len(text.split())
+        chars += len(text.strip())
+
+    return words, chars, paragraphs
+
+
+def strip_comments(lines, position, arg):
+    """Build filter leaving out RST comments, the way `count_text()` sees them. Blank lines
+    are kept between what's left, but not at the ends, so adding a comment changes nothing.
+    """
+
+    in_comment = False
+    started = False
+    # Blank lines, only written if more text follows
+    pending = []
+
+    for line in lines:
+        text = line.decode('utf-8', 'replace').rstrip()
+
+        if not text:
+            # One is enough to keep what's on either side of a comment apart
+            if not (in_comment and pending):
+                pending.append(line)
+            continue
+
+        if in_comment and text[0].isspace():
+            continue
+
+        in_comment = starts_comment(text)
+        if in_comment:
+            continue
+
+        if started:
+            for blank in pending:
+                yield blank
+        pending = []
+        started = True
+
+        yield line
+
+
+def drop_header(lines, position, arg):
+    """Build filter leaving out the title and description comments `SceneManager.refresh_scene()`
+    puts at the top of every scene, and the blank line after them. Goes before `strip_comments()`,
+    which would leave it nothing to drop.
+    """
+
+    lines = iter(lines)
+
+    head = []
+    for line in lines:
+        head.append(line)
+        if len(head) == 3:
+            break
+
+    is_comment = [starts_comment(line.decode('utf-8', 'replace').rstrip()) for line in head[:2]]
+    if not (len(head) == 3 and all(is_comment) and not head[2].strip()):
+        for line in head:
+            yield line
+
+    for line in lines:
+        yield line
+
+
+def separators(lines, position, arg):
+    """Build filter putting a transition, `arg` or `----`, between the scenes of a chapter.
+    `SceneManager.variants()` makes sure `arg` is one.
+    """
+
+    if position > 0:
+        yield '{}\n\n'.format(arg or '----').encode('utf-8')
+
+    for line in lines:
+        yield line
+
+
+# What builds configured in the snowflake can do with each scene, in order, see `SceneManager.variants()`.
+# Filters get the lines of a scene, its position in its chapter and their argument, and return the lines to write.
+BUILD_FILTERS = OrderedDict((
+    ('strip-comments', strip_comments),
+    ('drop-header', drop_header),
+    ('separators', separators),
+))
+
+
+def format_counts(counts):
+    """Return word `counts` from `count_text()` for showing after a menu line
+    """
+
+    if counts is None:
+        return ''
+
+    return ' ({}w)'.format(counts[0])
+
+
+class ConversionError(RuntimeError):
+    """Converting a document failed
+    """
+
+    def __init__(self, path, message):
+        super().__init__(message)
+
+        self.path = path
+
+
+def convert(path):
+    """Convert `path` with `CONVERSION`
+    """
+
+    cmd = CONVERSION[0]
+
+    try:
+        proc = subprocess.run([cmd, path, converted_path(path)], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise ConversionError(path, '{} failed to run: {}'.format(cmd, e))
+
+    if proc.returncode != 0:
+        # The last line usually says what's wrong
+        errors = proc.stderr.decode('utf-8', 'replace').strip().splitlines()
+        reason = errors[-1] if errors else 'no output'
+        raise ConversionError(path, '{} exited with {}: {}'.format(cmd, proc.returncode, reason))
+
+
+def detach_document(document):
+    """Let go of what a docutils document needs only while being processed, so it can be pickled
+    """
+
+    document.reporter = None
+    document.transformer = None
+    document.settings.warning_stream = None
+
+
+def find_nodes(tree, cls):
+    """Return the nodes of `cls` in the doctree `tree`, whichever docutils this is
+    """
+
+    return list(tree.findall(cls) if hasattr(tree, 'findall') else tree.traverse(cls))
+
+
+def docutils_settings():
+    """Return the settings documents are parsed and composed with
+    """
+
+    import docutils.core
+    import docutils.parsers.rst
+    import docutils.readers.standalone
+
+    publisher = docutils.core.Publisher(reader=docutils.readers.standalone.Reader(),
+                                        parser=docutils.parsers.rst.Parser())
+
+    return publisher.get_settings(**DOCUTILS_SETTINGS)
+
+
+def parse_cached(source, settings):
+    """Return the doctree of the RST `source` bytes, parsed only if it hasn't been before.
+    No transforms are applied, so references can still be resolved across the parts of
+    a document, see `publish()`. Doctrees are pickled by content hash in the user's cache,
+    so any worker, of any project, can use what another one parsed.
+    """
+
+    import docutils
+    import docutils.parsers.rst
+    import docutils.utils
+    import pickle
+
+    key = hashlib.sha1(docutils.__version__.encode('utf-8') + b'\0raw\0' + source).hexdigest()
+    path = os.path.join(SNOWFLAKE_DOCTREES_DIR, '{}.pickle'.format(key))
+
+    try:
+        with open(path, 'rb') as f:
+            document = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+    else:
+        # Keep it from being pruned, see `prune_doctrees()`
+        os.utime(path)
+        return document
+
+    document = docutils.utils.new_document('<part>', settings)
+    docutils.parsers.rst.Parser().parse(source.decode('utf-8', 'replace'), document)
+    detach_document(document)
+
+    # Workers may be parsing the same text at the same time, each writes its own
+    os.makedirs(SNOWFLAKE_DOCTREES_DIR, mode=0o700, exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(document, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    return document
+
+
+def prune_doctrees():
+    """Remove the cached doctrees not used for `DOCTREE_MAX_AGE`
+    """
+
+    if not os.path.exists(SNOWFLAKE_DOCTREES_DIR):
+        return
+
+    cutoff = time.time() - DOCTREE_MAX_AGE
+    for entry in os.scandir(SNOWFLAKE_DOCTREES_DIR):
+        if entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+
+def compose_part(document, tree):
+    """Move the contents of the untransformed doctree `tree` into `document`, along with
+    what docutils keeps track of to resolve references and number footnotes later.
+    Ids `document` already has, eg. of auto-numbered footnotes, are renamed in `tree`.
+    """
+
+    import docutils.nodes
+
+    elements = find_nodes(tree, docutils.nodes.Element)
+
+    renamed = {}
+    for element in elements:
+        for old in element.get('ids', ()):
+            if old not in document.ids:
+                continue
+
+            n = 2
+            while '{}-{}'.format(old, n) in document.ids or '{}-{}'.format(old, n) in tree.ids:
+                n += 1
+            renamed[old] = '{}-{}'.format(old, n)
+
+    if renamed:
+        for element in elements:
+            for attr in ('ids', 'backrefs'):
+                if attr in element:
+                    element[attr] = [renamed.get(old, old) for old in element[attr]]
+            if element.get('refid') in renamed:
+                element['refid'] = renamed[element['refid']]
+
+    for old, element in tree.ids.items():
+        document.ids[renamed.get(old, old)] = element
+
+    for old, refs in tree.refids.items():
+        document.refids.setdefault(renamed.get(old, old), []).extend(refs)
+
+    for attr in ('refnames', 'footnote_refs', 'citation_refs'):
+        for name, refs in getattr(tree, attr).items():
+            getattr(document, attr).setdefault(name, []).extend(refs)
+
+    for attr in ('autofootnotes', 'autofootnote_refs', 'symbol_footnotes', 'symbol_footnote_refs', 'footnotes',
+                 'citations', 'indirect_targets', 'parse_messages', 'transform_messages'):
+        getattr(document, attr).extend(getattr(tree, attr))
+
+    # The last definition wins, like within a document
+    document.substitution_defs.update(tree.substitution_defs)
+    document.substitution_names.update(tree.substitution_names)
+
+    # Newer docutils also map names to the elements they name
+    names = getattr(tree, 'names', None) if isinstance(getattr(tree, 'names', None), dict) else None
+
+    for name, explicit in tree.nametypes.items():
+        target_id = renamed.get(tree.nameids.get(name), tree.nameids.get(name))
+        element = names.get(name) if names is not None else document.ids.get(target_id)
+
+        if name in document.nametypes and not (explicit and not document.nametypes[name]):
+            # Only an explicit target overrides what an earlier part has by that name
+            if element is not None:
+                docutils.nodes.dupname(element, name)
+
+            if explicit:
+                document.nameids[name] = None
+                if names is not None:
+                    document.names[name] = None
+
+                message = document.reporter.warning('Duplicate explicit target name: "{}".'.format(name))
+                document.transform_messages.append(message)
+            continue
+
+        document.nameids[name] = target_id
+        document.nametypes[name] = explicit
+        if names is not None:
+            document.names[name] = element
+
+    # Transforms directives left for later
+    for element in elements:
+        if isinstance(element, docutils.nodes.pending):
+            document.note_pending(element)
+
+    children = tree.children
+    tree.children = []
+
+    return children
+
+
+def publish(path, parts, writers):
+    """Convert `path` with docutils for each of `writers`, (writer name, output path) pairs,
+    in a conversion worker. The document is composed of the doctrees of its `parts`, see
+    `Manager.build()`, so only text not parsed before is parsed, and just once for all writers.
+    References and footnotes are resolved on the whole document, as if it was parsed in one go.
+    Return the warnings and errors docutils had, as lines to show.
+    """
+
+    import docutils.core
+    import docutils.nodes
+    import docutils.parsers.rst
+    import docutils.readers.standalone
+    import docutils.utils
+    import pickle
+    import warnings
+
+    try:
+        settings = docutils_settings()
+        document = docutils.utils.new_document(path, settings)
+
+        # Where the messages of each part came from
+        sources = {}
+
+        parent = document
+        with open(path, 'rb') as f:
+            for part in parts if parts is not None else [('text', 0, os.path.getsize(path), path)]:
+                if part[0] == 'chapter':
+                    parent = docutils.nodes.section()
+                    parent += docutils.nodes.title(text=part[1])
+                    parent['names'].append(docutils.nodes.fully_normalize_name(part[1]))
+                    document.note_implicit_target(parent, parent)
+                    document += parent
+                    continue
+
+                # Only one part at a time is read
+                f.seek(part[1])
+                tree = parse_cached(f.read(part[2] - part[1]), settings)
+                for message in find_nodes(tree, docutils.nodes.system_message) + tree.parse_messages:
+                    sources[id(message)] = part[3]
+
+                parent.extend(compose_part(document, tree))
+
+        # What the standalone reader would do after parsing, on the whole document
+        document.transformer.populate_from_components((docutils.readers.standalone.Reader(),
+                                                       docutils.parsers.rst.Parser()))
+        document.transformer.apply_transforms()
+
+        messages = []
+        loose = [message for message in document.parse_messages + document.transform_messages if message.parent is None]
+        for message in find_nodes(document, docutils.nodes.system_message) + loose:
+            if message['level'] < docutils.utils.Reporter.WARNING_LEVEL:
+                continue
+
+            text = message.children[0].astext() if message.children else ''
+            messages.append('{}: ({}) {}'.format(sources.get(id(message), path), message['type'], text))
+
+        # Every writer gets a copy of its own, as they change what they write
+        detach_document(document)
+        composed = pickle.dumps(document, pickle.HIGHEST_PROTOCOL)
+
+        for writer_name, out_path in writers:
+            with warnings.catch_warnings():
+                # Writers warn about their defaults changing some day
+                warnings.simplefilter('ignore', FutureWarning)
+                output = docutils.core.publish_from_doctree(pickle.loads(composed), writer_name=writer_name,
+                                                            settings_overrides=DOCUTILS_SETTINGS)
+
+            write_atomic(out_path, output.encode('utf-8') if isinstance(output, str) else output)
+    except Exception as e:
+        # docutils' own exceptions don't necessarily survive the trip back
+        raise RuntimeError('docutils failed: {}'.format(e))
+
+    return messages
+
+
+def load_writers():
+    """Import the docutils writers of `BUILD_FORMATS`, so a conversion worker has them at hand
+    """
+
+    import docutils.writers
+
+    for writer_name, extension in BUILD_FORMATS.values():
+        docutils.writers.get_writer_class(writer_name)
+
+
+class Converter:
+    """Run conversions in parallel. With docutils around, this happens in a pool of long-lived
+    worker processes started warm on first use, otherwise `CONVERSION` is run for each document.
+    """
+
+    def __init__(self):
+        """Set initial data
+        """
+
+        # Looked up on first use
+        self.use_docutils = None
+        self.pool = None
+
+    def submit(self, path, parts=None, formats=('odt',)):
+        """Start converting `path` made of `parts` to `formats`, return a future for it.
+        Its result is what docutils had to say about the document, if anything.
+        """
+
+        if self.use_docutils is None:
+            self.use_docutils = importlib.util.find_spec('docutils') is not None
+
+        if self.pool is None:
+            workers = os.cpu_count() or 1
+
+            if self.use_docutils:
+                import multiprocessing
+
+                # Forking this process could leave the workers with locks held by its other threads,
+                # so they're forked from a server that has imported docutils and this plugin instead
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload([__name__, 'docutils.core', 'docutils.parsers.rst',
+                                                    'docutils.readers.standalone'])
+                else:
+                    context = multiprocessing.get_context('spawn')
+
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, mp_context=context, initializer=load_writers)
+            else:
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+        if self.use_docutils:
+            writers = [(BUILD_FORMATS[fmt][0], converted_path(path, fmt)) for fmt in formats]
+            return self.pool.submit(publish, path, parts, writers)
+
+        if list(formats) != ['odt']:
+            future = concurrent.futures.Future()
+            future.set_exception(ConversionError(path, 'docutils is needed for {}'.format(', '.join(formats))))
+            return future
+
+        return self.pool.submit(convert, path)
+
+    def reset(self):
+        """Get rid of the workers, eg. after one has died. New ones are started when needed.
+        """
+
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+
+class Debouncer:
+    """Collect things to do and hand them to `callback` on a worker thread,
+    once nothing new has come in for `delay` seconds
+    """
+
+    def __init__(self, delay, callback):
+        """Set initial data
+        """
+
+        self.delay = delay
+        self.callback = callback
+
+        self.lock = threading.Lock()
+        self.run_lock = threading.Lock()
+
+        self.pending = set()
+        self.scheduled = False
+        self.timer = None
+
+    def schedule(self, *items):
+        """Add `items` to the pending set and restart the countdown
+        """
+
+        with self.lock:
+            self.pending.update(items)
+            self.scheduled = True
+
+            if self.timer is not None:
+                self.timer.cancel()
+
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Run the callback now for whatever is pending, if anything
+        """
+
+        with self.run_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+
+                if not self.scheduled:
+                    return
+
+                items = self.pending
+                self.pending = set()
+                self.scheduled = False
+
+            self.callback(items)
+
+    def cancel(self):
+        """Forget whatever is pending
+        """
+
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            self.pending = set()
+            self.scheduled = False
+
+
+def io_bytes():
+    """Return how many bytes this process has read and written so far, None if it's not known.
+    It's all of it, on every thread and including the RPC socket.
+    """
+
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            fields = dict(line.split(b': ') for line in f.read().splitlines())
+    except (OSError, ValueError):
+        return None
+
+    return int(fields[b'rchar']) + int(fields[b'wchar'])
+
+
+def percentile(values, fraction):
+    """Return the value `fraction` of the way through sorted `values`
+    """
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def profiled(method):
+    """Have the plugin's profiler keep track of calls to `method` while it's on, see `Profiler`
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return method(self, *args, **kwargs)
+
+        return self.profiler.run(method.__name__, method, self, *args, **kwargs)
+
+    return wrapper
+
+
+class Profiler:
+    """Keep wall time, RPC requests and bytes of process I/O of the latest calls of each
+    profiled handler, and optionally run one call of a chosen handler under cProfile
+    """
+
+    def __init__(self, nvim):
+        """Start counting requests to `nvim`
+        """
+
+        # Buffers, windows, `nvim.vars` and the like hold on to the session, not to `nvim`
+        self.session = nvim._session
+
+        # Handler name -> (wall seconds, RPC requests, I/O bytes) of its latest calls
+        self.samples = {}
+
+        # Name of the handler to run under cProfile the next time it's called
+        self.capture = None
+
+        self.rpcs = 0
+        self.request = self.session.request
+        self.session.request = self.count_request
+
+    def count_request(self, *args, **kwargs):
+        """Stand-in for the session's `request()`, which every request to Neovim goes through,
+        whichever object it's made with
+        """
+
+        self.rpcs += 1
+
+        return self.request(*args, **kwargs)
+
+    def stop(self):
+        """Stop counting requests to nvim
+        """
+
+        del self.session.request
+
+    def run(self, name, method, *args, **kwargs):
+        """Call `method` and keep track of how it went
+        """
+
+        rpcs = self.rpcs
+        io = io_bytes()
+        start = time.perf_counter()
+
+        try:
+            if self.capture != name:
+                return method(*args, **kwargs)
+
+            import cProfile
+
+            self.capture = None
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(method, *args, **kwargs)
+            finally:
+                self.save_capture(name, profile)
+        finally:
+            elapsed = time.perf_counter() - start
+            io = io_bytes() - io if io is not None else None
+
+            self.samples.setdefault(name, deque(maxlen=PROFILE_SAMPLES)).append((elapsed, self.rpcs - rpcs, io))
+
+    def save_capture(self, name, profile):
+        """Write the cProfile report of `name`
+        """
+
+        import io
+        import pstats
+
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(40)
+
+        make_cache_dir()
+
+        with open(SNOWFLAKE_PROFILE.format(name), 'wb') as f:
+            f.write(out.getvalue().encode('utf-8'))
+
+    def report(self):
+        """Return the report on every handler called so far, as lines
+        """
+
+        buckets = ['<{}'.format(limit) for limit in PROFILE_BUCKETS] + ['>={}'.format(PROFILE_BUCKETS[-1])]
+        lines = ['{:<28} {:>6} {:>26} {:>12} {:>22}   wall ms: {}'.format(
+            'handler', 'calls', 'wall ms p50/p90/max', 'rpcs p50/max', 'process io kB p50/max', ' '.join(buckets))]
+
+        for name, samples in sorted(self.samples.items()):
+            walls = sorted(1000 * wall for wall, _, _ in samples)
+            rpcs = sorted(count for _, count, _ in samples)
+            ios = sorted(io / 1024 for _, _, io in samples if io is not None) or [0]
+
+            histogram = [0] * len(buckets)
+            for wall in walls:
+                histogram[sum(1 for limit in PROFILE_BUCKETS if wall >= limit)] += 1
+
+            lines.append('{:<28} {:>6} {:>8.1f} {:>8.1f} {:>8.1f} {:>5} {:>6} {:>10.1f} {:>11.1f}   {}'.format(
+                name, len(samples), percentile(walls, 0.5), percentile(walls, 0.9), walls[-1],
+                percentile(rpcs, 0.5), rpcs[-1], percentile(ios, 0.5), ios[-1],
+                ' '.join('{:>{}}'.format(count, len(bucket)) for count, bucket in zip(histogram, buckets))))
+
+        return lines
+
+
+class Watcher:
+    """Tell `callback` which of the RST files in `directories`, or which of `files`, changed,
+    eg. by `git pull` or another editor. Runs on its own thread, using inotify where
+    there is one and looking for changed mtimes and sizes every now and then where not.
+    """
+
+    # From <sys/inotify.h>
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+
+    def __init__(self, directories, files, callback):
+        """Set initial data
+        """
+
+        self.directories = [os.path.normpath(directory) for directory in directories]
+        self.files = set(os.path.normpath(path) for path in files)
+        self.callback = callback
+
+        # inotify watch descriptor -> directory
+        self.watches = {}
+
+    def start(self):
+        """Start watching with inotify, or polling if that can't be had. Whatever happens
+        after this returns gets noticed.
+        """
+
+        try:
+            fd = self.setup_inotify()
+        except (OSError, AttributeError):
+            target, args = self.poll, (self.snapshot(),)
+        else:
+            target, args = self.read_inotify, (fd,)
+
+        thread = threading.Thread(target=target, args=args, name='snowflake-watcher')
+        thread.daemon = True
+        thread.start()
+
+    def wanted(self, directory, name):
+        """Return the path of `name` in `directory` if it's something to watch, else None
+        """
+
+        path = os.path.normpath(os.path.join(directory, name))
+
+        if directory in self.directories and name.endswith('.rst'):
+            return path
+
+        if path in self.files:
+            return path
+
+    def setup_inotify(self):
+        """Return an inotify descriptor watching everything
+        """
+
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+
+        # Files are watched through their directories, as they get replaced rather than rewritten
+        for directory in set(self.directories) | set(os.path.dirname(path) or os.curdir for path in self.files):
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), mask)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch {} failed'.format(directory))
+
+            self.watches[wd] = directory
+
+        return fd
+
+    def read_inotify(self, fd):
+        """Hand over the changes inotify reports, a read's worth at a time
+        """
+
+        import struct
+
+        header = struct.Struct('iIII')
+
+        while True:
+            data = os.read(fd, 65536)
+
+            paths = set()
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = header.unpack_from(data, offset)
+                name = data[offset + header.size:offset + header.size + length].rstrip(b'\0')
+                offset += header.size + length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    # Missed some, so anything might have changed
+                    paths.update(self.snapshot())
+                elif wd in self.watches:
+                    path = self.wanted(self.watches[wd], os.fsdecode(name))
+                    if path is not None:
+                        paths.add(path)
+
+            if paths:
+                self.callback(paths)
+
+    def snapshot(self):
+        """Return {path: (mtime, size)} of everything watched
+        """
+
+        stats = {}
+
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if entry.name.endswith('.rst'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+
+                    stats[os.path.normpath(entry.path)] = (st.st_mtime_ns, st.st_size)
+
+        for path in self.files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            stats[os.path.normpath(path)] = (st.st_mtime_ns, st.st_size)
+
+        return stats
+
+    def poll(self, old):
+        """Hand over what changed since the last look, starting from the `snapshot()` in `old`,
+        every `WATCH_POLL_INTERVAL` seconds
+        """
+
+        while True:
+            time.sleep(WATCH_POLL_INTERVAL)
+
+            new = self.snapshot()
+            paths = set(path for path in set(old) | set(new) if old.get(path) != new.get(path))
+            old = new
+
+            if paths:
+                self.callback(paths)
+
+
+class FileCache:
+    """Remember things about files for as long as their mtime and size stay the same
+    """
+
+    def __init__(self, path):
+        """Load the cache from `path` if there is one
+        """
+
+        self.path = path
+        self.dirty = False
+
+        # Shared by the managers, which change it on the main and the refresher's thread
+        self.lock = threading.Lock()
+
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                try:
+                    self.entries = json.loads(f.read().decode('utf-8'))
+                except ValueError:
+                    # A broken cache is as good as none
+                    pass
+
+    def get(self, filename, st):
+        """Return the entry for `filename` if it is still valid for `st`
+        """
+
+        entry = self.entries.get(filename)
+        if entry is not None and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return entry
+
+    def set(self, filename, st, **fields):
+        """Store `fields` for `filename` as it is in `st`
+        """
+
+        entry = dict(fields, mtime=st.st_mtime_ns, size=st.st_size)
+
+        with self.lock:
+            if self.entries.get(filename) != entry:
+                self.entries[filename] = entry
+                self.dirty = True
+
+    def save(self):
+        """Flush the thing to disk if anything changed
+        """
+
+        with self.lock:
+            if not self.dirty:
+                return
+
+            make_cache_dir()
+
+            write_atomic(self.path, json.dumps(self.entries).encode('utf-8'))
+
+            self.dirty = False
+
+
+class SearchIndex:
+    """Which lines of which files each word is on, for `:SnowflakeSearch`. Loaded in the
+    background at startup, only reading the files changed since they were last indexed,
+    and after that kept up to date a file at a time as they are written.
+    """
+
+    def __init__(self, path):
+        """Set initial data
+        """
+
+        self.path = path
+        self.loaded = False
+
+        # Loading, updating and searching happen on different threads
+        self.lock = threading.Lock()
+        self.saver = Debouncer(SAVE_DELAY, lambda items: self.save())
+
+        # Normalized filename -> [mtime, size, {word: [line, ...]}], as saved
+        self.files = {}
+
+        # Word -> {normalized filename: [line, ...]}
+        self.words = {}
+
+    def load(self, filenames):
+        """Load the index, and bring it up to date with `filenames`, all there is to search
+        """
+
+        with self.lock:
+            if self.loaded:
+                return
+
+            if os.path.exists(self.path):
+                with open(self.path, 'rb') as f:
+                    try:
+                        self.files = json.loads(f.read().decode('utf-8'))
+                    except ValueError:
+                        # Just index everything again
+                        self.files = {}
+
+            for filename, (mtime, size, words) in self.files.items():
+                self.add_words(filename, words)
+
+            self.loaded = True
+
+            wanted = set(filenames)
+            changed = False
+            for filename in [filename for filename in self.files if filename not in wanted]:
+                self.remove(filename)
+                changed = True
+
+            if self.index_files(filenames) or changed:
+                self.saver.schedule()
+
+    def update(self, filenames):
+        """Index `filenames` again if they've changed, once the index is loaded. Until then,
+        `load()` will notice they have.
+        """
+
+        with self.lock:
+            if self.loaded and self.index_files(filenames):
+                self.saver.schedule()
+
+    def index_files(self, filenames):
+        """Index those of `filenames` that changed since they were last indexed.
+        Return True if any were.
+        """
+
+        changed = False
+        for filename in filenames:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                if filename in self.files:
+                    self.remove(filename)
+                    changed = True
+                continue
+
+            known = self.files.get(filename)
+            if known is not None and known[:2] == [st.st_mtime_ns, st.st_size]:
+                continue
+
+            words = {}
+            with open(filename, 'rb') as f:
+                for lnum, line in enumerate(f, 1):
+                    for word in SEARCH_WORD.findall(line.decode('utf-8', 'replace').lower()):
+                        lines = words.setdefault(word, [])
+                        if not lines or lines[-1] != lnum:
+                            lines.append(lnum)
+
+            self.remove(filename)
+            self.files[filename] = [st.st_mtime_ns, st.st_size, words]
+            self.add_words(filename, words)
+            changed = True
+
+        return changed
+
+    def add_words(self, filename, words):
+        for word, lines in words.items():
+            self.words.setdefault(word, {})[filename] = lines
+
+    def remove(self, filename):
+        """Forget about `filename`
+        """
+
+        known = self.files.pop(filename, None)
+        if known is None:
+            return
+
+        for word in known[2]:
+            postings = self.words[word]
+            del postings[filename]
+            if not postings:
+                del self.words[word]
+
+    def search(self, query):
+        """Return (normalized filename, [line, ...]) for the files that have all the words
+        of `query`, with the lines any of them are on
+        """
+
+        words = SEARCH_WORD.findall(query.lower())
+        if not words:
+            return []
+
+        with self.lock:
+            postings = sorted((self.words.get(word, {}) for word in words), key=len)
+            if len(postings) == 1:
+                return list(postings[0].items())
+
+            return [(filename, sorted(set().union(*(found[filename] for found in postings))))
+                    for filename in postings[0] if all(filename in found for found in postings[1:])]
+
+    def save(self):
+        """Flush the thing to disk
+        """
+
+        with self.lock:
+            data = json.dumps(self.files).encode('utf-8')
+
+        make_cache_dir()
+
+        write_atomic(self.path, data)
+
+
+class BuildManifest:
+    """Content hashes of what every output was built from, so unchanged outputs can be skipped
+    """
+
+    def __init__(self, path, formats=('odt',)):
+        """Load the manifest from `path` if there is one. Outputs are converted to `formats`.
+        """
+
+        self.path = path
+        self.formats = formats
+
+        # Input path -> [mtime, size, digest], to avoid hashing unchanged files again
+        self.files = {}
+        # Output path -> [[input path, digest], ...] as of the last successful build
+        self.outputs = {}
+        # Output path -> digest of its own contents as last converted
+        self.contents = {}
+        # Output path -> digests as checked but not yet recorded
+        self.pending = {}
+        self.pending_contents = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                try:
+                    data = json.loads(f.read().decode('utf-8'))
+                    self.files = data['files']
+                    self.outputs = data['outputs']
+                    self.contents = data.get('contents', {})
+                except (ValueError, KeyError):
+                    # Just build everything
+                    pass
+
+    def digest(self, path):
+        """Return the content hash of `path`
+        """
+
+        st = os.stat(path)
+        known = self.files.get(path)
+        if known is not None and known[:2] == [st.st_mtime_ns, st.st_size]:
+            return known[2]
+
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                sha.update(chunk)
+
+        self.files[path] = [st.st_mtime_ns, st.st_size, sha.hexdigest()]
+
+        return self.files[path][2]
+
+    def check(self, output, inputs, outline=None):
+        """Return why `output` needs to be built from `inputs`, or None if it is up to date.
+        `outline` is what else goes in it as text, eg. the chapter headings.
+        """
+
+        digests = [[path, self.digest(path)] for path in inputs]
+        if outline is not None:
+            digests.append(['outline', hashlib.sha1(outline.encode('utf-8')).hexdigest()])
+            inputs = inputs + ['outline']
+        self.pending[output] = digests
+
+        old = self.outputs.get(output)
+        if old is None:
+            return 'new'
+
+        missing = self.missing(output)
+        if missing is not None:
+            return '{} missing'.format(missing)
+
+        old_paths = [path for path, _ in old]
+        if old_paths != inputs:
+            if sorted(old_paths) == sorted(inputs):
+                return 'order changed'
+
+            return 'files added or removed'
+
+        changed = [path for (path, digest), (_, old_digest) in zip(digests, old) if digest != old_digest]
+        if changed:
+            if len(changed) > 3:
+                changed[3:] = ['{} more'.format(len(changed) - 3)]
+
+            return '{} changed'.format(', '.join(changed))
+
+    def content_changed(self, output, digest):
+        """Return True if `output`, now with contents hashing to `digest`, needs converting
+        """
+
+        self.pending_contents[output] = digest
+
+        return self.contents.get(output) != digest or self.missing(output) is not None
+
+    def missing(self, output):
+        """Return a converted document of `output` that isn't there, if any
+        """
+
+        for fmt in self.formats:
+            if not os.path.exists(converted_path(output, fmt)):
+                return converted_path(output, fmt)
+
+    def record(self, output):
+        """Mark `output` as successfully built from what it was last checked against
+        """
+
+        self.outputs[output] = self.pending.pop(output)
+        if output in self.pending_contents:
+            self.contents[output] = self.pending_contents.pop(output)
+
+    def save(self):
+        """Flush the thing to disk
+        """
+
+        data = {'files': self.files, 'outputs': self.outputs, 'contents': self.contents}
+        write_atomic(self.path, json.dumps(data).encode('utf-8'))
+
+
+class SessionLog:
+    """What happened while writing: time spent in insert mode and words added, by file.
+    Events are kept in memory for a while and appended to the log in batches, and
+    `stats()` only reads what has been appended since it was last asked.
+    """
+
+    def __init__(self, path, stats_path):
+        """Set initial data
+        """
+
+        self.path = path
+        self.stats_path = stats_path
+
+        self.lock = threading.Lock()
+        self.events = []
+        self.writer = Debouncer(LOG_DELAY, lambda items: self.flush())
+
+    def record(self, filename, **fields):
+        """Remember something that happened to `filename` just now
+        """
+
+        event = dict(fields, time=int(time.time()), file=normalize_path(filename))
+
+        with self.lock:
+            self.events.append(event)
+
+        self.writer.schedule()
+
+    def flush(self):
+        """Append what has been recorded to the log
+        """
+
+        with self.lock:
+            events = self.events
+            self.events = []
+
+        if not events:
+            return
+
+        with open(self.path, 'ab') as f:
+            f.write(b''.join(json.dumps(event, sort_keys=True).encode('utf-8') + b'\n' for event in events))
+
+    def stats(self):
+        """Return {'days': {date: totals}, 'files': {filename: totals}} for the whole log,
+        with totals being {'insert': seconds, 'words': words added}
+        """
+
+        self.writer.flush()
+
+        stats = {'offset': 0, 'days': {}, 'files': {}}
+        if os.path.exists(self.stats_path):
+            with open(self.stats_path, 'rb') as f:
+                try:
+                    stats = json.loads(f.read().decode('utf-8'))
+                except ValueError:
+                    # Count it all again
+                    pass
+
+        if not os.path.exists(self.path):
+            return stats
+
+        if os.path.getsize(self.path) < stats['offset']:
+            # Not the log these were counted from
+            stats = {'offset': 0, 'days': {}, 'files': {}}
+
+        with open(self.path, 'rb') as f:
+            f.seek(stats['offset'])
+
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Still being written, or torn by a crash
+                    break
+
+                stats['offset'] += len(line)
+
+                try:
+                    event = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+
+                day = time.strftime('%Y-%m-%d', time.localtime(event['time']))
+                for totals in (stats['days'].setdefault(day, {}), stats['files'].setdefault(event['file'], {})):
+                    for key in ('insert', 'words'):
+                        totals[key] = totals.get(key, 0) + event.get(key, 0)
+
+        make_cache_dir()
+
+        write_atomic(self.stats_path, json.dumps(stats).encode('utf-8'))
+
+        return stats
+
+
+class Scene:
+    """One scene in the scene list
+    """
+
+    __slots__ = ('title', 'descr', 'filename', 'counts')
+
+    def __init__(self, title, descr, filename):
+        """Set initial data
+        """
+
+        self.title = title
+        self.descr = descr
+        self.filename = filename
+
+        # (words, characters, paragraphs) of the file, once it's been looked at
+        self.counts = None
+
+    def __repr__(self):
+        return 'Scene({!r}, {!r}, {!r})'.format(self.title, self.descr, self.filename)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Make a scene out of its YAML mapping
+        """
+
+        return cls(data.get('title', ''), data.get('descr', ''), data['filename'])
+
+    def to_dict(self):
+        """Return the YAML mapping of the scene
+        """
+
+        return OrderedDict((
+            ('title', self.title),
+            ('descr', self.descr),
+            ('filename', self.filename),
+        ))
+
+    def to_list(self):
+        """Return the scene as a list for JSON, see `entry_from_list()`
+        """
+
+        return [self.title, self.descr, self.filename]
+
+    def copy(self):
+        return Scene(self.title, self.descr, self.filename)
+
+
+class Chapter:
+    """A chapter in the scene list, the scenes after it up to the next one are in it
+    """
+
+    __slots__ = ('title', 'expanded')
+
+    # Not having these is what sets chapters apart from scenes
+    filename = None
+    descr = None
+    counts = None
+
+    def __init__(self, title):
+        """Set initial data
+        """
+
+        self.title = title
+
+        # Whether the menu shows the scenes in it
+        self.expanded = False
+
+    def __repr__(self):
+        return 'Chapter({!r})'.format(self.title)
+
+    def to_dict(self):
+        """Return the YAML mapping of the chapter
+        """
+
+        return OrderedDict((('chapter', self.title),))
+
+    def to_list(self):
+        """Return the chapter as a list for JSON, see `entry_from_list()`
+        """
+
+        return [self.title]
+
+    def copy(self):
+        return Chapter(self.title)
+
+
+def entry_from_dict(data):
+    """Return the scene or chapter of a mapping in the scene list YAML
+    """
+
+    if 'chapter' in data:
+        return Chapter(data['chapter'])
+
+    return Scene.from_dict(data)
+
+
+def entry_from_list(data):
+    """Return the scene or chapter of a `to_list()` list
+    """
+
+    if len(data) == 1:
+        return Chapter(*data)
+
+    return Scene(*data)
+
+
+class SceneList:
+    """The scenes and chapters in order, with an index of where each scene file is in the list.
+    Positions are only recalculated from the first changed one onwards, and only when
+    asked for, so moving a scene a step or two stays cheap however long the list is.
+    """
+
+    def __init__(self, scenes=()):
+        """Set initial data
+        """
+
+        self.scenes = list(scenes)
+
+        # Normalized filename -> scene
+        self.by_filename = dict(
+            (normalize_path(scene.filename), scene) for scene in self.scenes if scene.filename is not None)
+
+        # Normalized filename -> position, correct for everything before `self.valid`
+        # and possibly stale after it
+        self.positions = {}
+        self.valid = 0
+
+        # Positions of the chapters, worked out when asked for
+        self.chapter_positions = None
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def __iter__(self):
+        return iter(self.scenes)
+
+    def __getitem__(self, idx):
+        return self.scenes[idx]
+
+    def reset(self, scenes):
+        """Replace all the scenes with `scenes`
+        """
+
+        self.scenes[:] = scenes
+        self.by_filename = dict(
+            (normalize_path(scene.filename), scene) for scene in self.scenes if scene.filename is not None)
+        self.positions = {}
+        self.valid = 0
+        self.chapter_positions = None
+
+    def invalidate(self, idx):
+        """Forget positions from `idx` onwards
+        """
+
+        self.valid = min(self.valid, idx)
+
+    def shift_chapters(self, idx, scene, delta):
+        """Keep the chapter positions right when `scene` is added at or removed from `idx`
+        """
+
+        if self.chapter_positions is None:
+            return
+
+        if scene.filename is None:
+            self.chapter_positions = None
+            return
+
+        first = bisect.bisect_left(self.chapter_positions, idx)
+        self.chapter_positions[first:] = [position + delta for position in self.chapter_positions[first:]]
 
-# XXX: Just assume this exists
-CONVERSION = ('/usr/bin/rst2odt', '.odt')
+    def insert(self, idx, scene):
+        """Insert `scene` before `idx`
+        """
+
+        self.scenes.insert(idx, scene)
+        if scene.filename is not None:
+            self.by_filename[normalize_path(scene.filename)] = scene
+        self.invalidate(idx)
+        self.shift_chapters(idx, scene, 1)
+
+    def pop(self, idx):
+        """Remove and return the scene at `idx`
+        """
+
+        scene = self.scenes.pop(idx)
+        if scene.filename is not None:
+            key = normalize_path(scene.filename)
+            del self.by_filename[key]
+            self.positions.pop(key, None)
+        self.invalidate(idx)
+        self.shift_chapters(idx, scene, -1)
+
+        return scene
+
+    def move(self, from_idx, to_idx):
+        """Move the scene at `from_idx` to `to_idx`
+        """
+
+        self.scenes.insert(to_idx, self.scenes.pop(from_idx))
+
+        low, high = min(from_idx, to_idx), min(max(from_idx, to_idx), len(self.scenes) - 1)
+        if any(scene.filename is None for scene in self.scenes[low:high + 1]):
+            self.chapter_positions = None
+
+        if high < self.valid:
+            # Only what's in between moved, fix it up in place
+            for i in range(low, high + 1):
+                if self.scenes[i].filename is not None:
+                    self.positions[normalize_path(self.scenes[i].filename)] = i
+        else:
+            self.invalidate(low)
+
+    def chapters(self):
+        """Return the positions of the chapters
+        """
+
+        if self.chapter_positions is None:
+            self.chapter_positions = [i for i, scene in enumerate(self.scenes) if scene.filename is None]
+
+        return self.chapter_positions
+
+    def chapter_of(self, idx):
+        """Return the position of the chapter the scene at `idx` is in, or None
+        """
+
+        chapters = self.chapters()
+        found = bisect.bisect_right(chapters, idx) - 1
+
+        return chapters[found] if found >= 0 else None
+
+    def chapter_end(self, idx):
+        """Return where the chapter at `idx` ends, ie. the position of the next chapter or the end
+        """
+
+        chapters = self.chapters()
+        found = bisect.bisect_right(chapters, idx)
+
+        return chapters[found] if found < len(chapters) else len(self.scenes)
+
+    def get(self, filename):
+        """Return the scene stored in `filename`, or None
+        """
+
+        return self.by_filename.get(normalize_path(filename))
+
+    def position(self, filename):
+        """Return where the scene stored in `filename` is in the list, or None
+        """
+
+        key = normalize_path(filename)
+        scene = self.by_filename.get(key)
+        if scene is None:
+            return None
+
+        # Everything before `self.valid` is right, anything else may be stale
+        position = self.positions.get(key)
+        if position is not None and position < len(self.scenes) and self.scenes[position] is scene:
+            return position
+
+        while self.valid < len(self.scenes):
+            scene_filename = self.scenes[self.valid].filename
+            self.valid += 1
+
+            if scene_filename is None:
+                continue
+
+            scene_key = normalize_path(scene_filename)
+            self.positions[scene_key] = self.valid - 1
+
+            if scene_key == key:
+                return self.valid - 1
 
 
 class Manager:
@@ -27,26 +1857,46 @@ class Manager:
     # They all start collapsed
     expanded = False
 
+    # How to lay out the windows next to the menu, or None to leave them be
+    layout = None
+
+    def get_counts(self, filename):
+        """Return the counts of `filename` if it's one of ours and it has been counted
+        """
+
+        return None
+
+    def describe_file(self, filename):
+        """Return (position, title) of `filename` if it's one of ours, to show it by
+        """
+
+        return None
+
     @abc.abstractmethod
-    def contribute_to_menu(self, buf):
-        """Dummy for contributing to menu
+    def contribute_to_menu(self):
+        """Dummy for contributing to menu, return a list of (item index, line kind).
+        The text of the lines is only asked for when they are shown, see `menu_line()`.
         """
 
-        pass
+        return []
 
     @abc.abstractmethod
-    def set_layout(self, nvim):
-        """Configure the layout
+    def menu_line(self, idx, kind):
+        """Return the text of a line `contribute_to_menu()` returned
         """
 
-        pass
+        return ''
 
     @abc.abstractmethod
-    def build(self, snowflake):
-        """Implement this to build your document(s)
+    def build(self, snowflake, manifest):
+        """Implement this to write your document(s), skipping the ones `manifest` says
+        are up to date. Return a list of (output, reason, parts) for what needs converting.
+        `parts` are ('text', start, end, source) byte ranges of the output with the file
+        they came from, each parsed on its own and cached, and ('chapter', title) headings
+        between them, or None for one part.
         """
 
-        pass
+        return []
 
 
 class SnowflakeManager(Manager):
@@ -69,99 +1919,137 @@ class SnowflakeManager(Manager):
         ('synopsis', '.. You may also write a longer synopsis instead of this comment.'),
     ))
 
-    def contribute_to_menu(self, buf):
-        """Affect what is shown in the menu in `buf`
+    # One-line across the top, the longer ones side by side below it
+    layout = Split(False, (
+        Pane(snowflake_files['one-line'], 3, 'nonumber norelativenumber foldcolumn=0'),
+        Split(True, (
+            Pane(snowflake_files['one-paragraph'], 60, 'textwidth=60'),
+            Pane(snowflake_files['one-page'], 80, 'textwidth=80'),
+            Pane(snowflake_files['synopsis'], 90, 'textwidth=90'),
+        )),
+    ))
+
+    def __init__(self, cache):
+        """Set initial data
         """
 
-        prefix = '-' if self.expanded else '+'
-        title = '{}{}'.format(prefix, self.title)
+        # Shared with the scenes, normalized filename -> counts as of the file's last read
+        self.cache = cache
 
-        buf.append(title)
-        if self.expanded:
-            for snowflake_file in self.snowflake_files.values():
-                fname = snowflake_file.rsplit(os.sep, 1)[-1]
+        # Key in `snowflake_files` -> (words, characters, paragraphs)
+        self.counts = {}
+
+    def refresh_counts(self, filenames=None):
+        """Count the words in the snowflake files among `filenames`, or all of them.
+        Nothing is read if a file's mtime and size are what they were the last time.
+        Return True if any counts changed.
+        """
+
+        if filenames is not None:
+            filenames = set(normalize_path(filename) for filename in filenames)
+
+        changed = False
+        for key, snowflake_file in self.snowflake_files.items():
+            normalized = normalize_path(snowflake_file)
+            if (filenames is not None and normalized not in filenames) or not os.path.exists(snowflake_file):
+                continue
+
+            st = os.stat(snowflake_file)
+            entry = self.cache.get(normalized, st)
+            if entry is not None and 'words' in entry:
+                counts = (entry['words'], entry['chars'], entry['paragraphs'])
+            else:
+                with open(snowflake_file, 'rb') as f:
+                    counts = count_text(f)
+
+                self.cache.set(normalized, st, words=counts[0], chars=counts[1], paragraphs=counts[2])
+
+            if self.counts.get(key) != counts:
+                self.counts[key] = counts
+                changed = True
 
-                buf.append('  {}'.format(fname))
-            buf.append('')
+        self.cache.save()
 
-    def set_layout(self, nvim):
-        """Create a layout here
+        return changed
+
+    def get_counts(self, filename):
+        """Return the counts of `filename` if it's one of ours and it has been counted
+        """
+
+        normalized = normalize_path(filename)
+        for key, snowflake_file in self.snowflake_files.items():
+            if normalize_path(snowflake_file) == normalized:
+                return self.counts.get(key)
+
+    def describe_file(self, filename):
+        """Return (position, title) of `filename` if it's one of ours, to show it by
         """
 
-        assert len(nvim.windows) == 2
+        normalized = normalize_path(filename)
+        for i, snowflake_file in enumerate(self.snowflake_files.values()):
+            if normalize_path(snowflake_file) == normalized:
+                return i, snowflake_file.rsplit(os.sep, 1)[-1]
 
-        # nvim.input('<C-w>l')
-        nvim.command('wincmd l')
+    def contribute_to_menu(self):
+        """Return the lines to show in the menu
+        """
 
-        # Create one-line
-        nvim.command('split')
-        nvim.command('edit {}'.format(self.snowflake_files['one-line']))
-        nvim.command('setlocal nonumber norelativenumber foldcolumn=0')
+        lines = [(None, 'header')]
+        if self.expanded:
+            lines.extend((i, 'file') for i in range(len(self.snowflake_files)))
+            lines.append((None, 'blank'))
 
-        # Go down for one-paragraph, one-page and synopsis
-        # nvim.input('<C-w>j')
-        nvim.command('wincmd j')
+        return lines
 
-        nvim.command('vsplit')
-        nvim.command('edit {}'.format(self.snowflake_files['one-paragraph']))
-        nvim.command('setlocal textwidth=60')
+    def menu_line(self, idx, kind):
+        """Return the text of a menu line
+        """
 
-        # nvim.input('<C-w>l')
-        nvim.command('wincmd l')
-        nvim.command('edit {}'.format(self.snowflake_files['one-page']))
-        nvim.command('setlocal textwidth=80')
+        if kind == 'header':
+            return '{}{}'.format('-' if self.expanded else '+', self.title)
 
-        nvim.command('vsplit')
-        # nvim.input('<C-w>l')
-        nvim.command('wincmd l')
-        nvim.command('edit {}'.format(self.snowflake_files['synopsis']))
-        nvim.command('setlocal textwidth=90')
+        if kind == 'file':
+            key, snowflake_file = list(self.snowflake_files.items())[idx]
+            fname = snowflake_file.rsplit(os.sep, 1)[-1]
 
-        ## XXX: Relying on numbers like this is generally dangerous
-        ##      but I think it's ok for this initial case
-        # Set the sizes
-        nvim.windows[0].width = 30
-        nvim.windows[1].height = 3
-        nvim.windows[2].width = 60
-        nvim.windows[3].width = 80
-        nvim.windows[4].width = 90
+            return '  {}{}'.format(fname, format_counts(self.counts.get(key)))
 
-        # Go to one-liner
-        nvim.command('2 wincmd w')
+        return ''
 
-    def build(self, snowflake):
+    def build(self, snowflake, manifest):
         """Compile the one-docs to one mega doc
         """
 
+        rebuilt = []
+
+        ones = ('one-line', 'one-paragraph', 'one-page')
         ones_out_path = os.path.join(SNOWFLAKE_OUT_DIR, SNOWFLAKE_ONE_DOCS_FILE)
-        with open(ones_out_path, 'wb') as out_f:
-            for item in ('one-line', 'one-paragraph', 'one-page'):
-                heading = item.rsplit('-', 1)[1]
-                heading = 'One {}'.format(heading)
+        reason = manifest.check(ones_out_path, [self.snowflake_files[item] for item in ones])
+        if reason is not None:
+            with open(ones_out_path, 'wb') as out_f:
+                for item in ones:
+                    heading = item.rsplit('-', 1)[1]
+                    heading = 'One {}'.format(heading)
 
-                with open(self.snowflake_files[item], 'rb') as f:
                     out_f.write(heading.encode('utf-8'))
                     out_f.write(b'\n')
                     out_f.write(len(heading.encode('utf-8')) * b'=')
                     out_f.write(b'\n\n')
 
-                    text = f.read().strip()
-                    out_f.write(text)
+                    copy_stripped(out_f, self.snowflake_files[item])
                     out_f.write(b'\n\n')
 
-        synopsis_out_path = os.path.join(SNOWFLAKE_OUT_DIR, 'synopsis.rst')
-        with open(synopsis_out_path, 'wb') as out_f:
-            with open(self.snowflake_files['synopsis'], 'rb') as f:
-                out_f.write(f.read())
+            rebuilt.append((ones_out_path, reason, None))
 
-        cmd, suffix = CONVERSION
-        for path in (ones_out_path, synopsis_out_path):
-            converted_path = path.rsplit('.', 1)[0] + suffix
+        synopsis_out_path = os.path.join(SNOWFLAKE_OUT_DIR, 'synopsis.rst')
+        reason = manifest.check(synopsis_out_path, [self.snowflake_files['synopsis']])
+        if reason is not None:
+            with open(synopsis_out_path, 'wb') as out_f:
+                copy_into(out_f, self.snowflake_files['synopsis'])
 
-            retval = subprocess.call([cmd, path, converted_path])
+            rebuilt.append((synopsis_out_path, reason, None))
 
-            if retval != 0:
-                raise RuntimeError('Command failed')
+        return rebuilt
 
 
 class SceneManager(Manager):
@@ -170,135 +2058,681 @@ class SceneManager(Manager):
 
     title = 'SCENES'
 
-    def __init__(self):
+    def __init__(self, cache):
         """Set initial data
         """
 
-        if os.path.exists(SNOWFLAKE_SCENES_YAML):
-            with open(SNOWFLAKE_SCENES_YAML, 'rb') as f:
-                self.scenes = yaml.load(f.read())
-                self.refresh_scenes()
+        # Normalized filename -> title, description and counts as of the file's last read
+        self.cache = cache
+
+        # Sum of the counts of all the scenes, kept up to date as they change
+        self.totals = (0, 0, 0)
+
+        # Refreshes happen on a worker thread, and saving is deferred to one
+        self.lock = threading.RLock()
+        self.saver = Debouncer(SAVE_DELAY, lambda items: self.flush())
+
+        # Content hash of the YAML the journal applies to, None if there's no YAML yet,
+        # and the [mtime, size] it had, to notice it being changed by something else
+        self.base = None
+        self.yaml_stat = None
+
+        if os.path.exists(SNOWFLAKE_SCENES_YAML) or os.path.exists(SNOWFLAKE_SCENES_JOURNAL):
+            self.scenes = SceneList(self.load())
+
+            # Get a clean journal right away, so nothing gets appended after a torn entry
+            if self.replay():
+                self.flush()
+
+            self.refresh_scenes()
         else:
-            self.scenes = []
+            self.scenes = SceneList()
 
-    def contribute_to_menu(self, buf):
-        """Affect what is shown in the menu in `buf`
+    def load(self):
+        """Load the scene list. The YAML is the real thing, but as long as it hasn't changed
+        since it was last saved, the much faster to parse sidecar has the same in it.
         """
 
-        prefix = '-' if self.expanded else '+'
-        title = '{}{}'.format(prefix, self.title)
+        if not os.path.exists(SNOWFLAKE_SCENES_YAML):
+            return []
 
-        buf.append(title)
+        st = os.stat(SNOWFLAKE_SCENES_YAML)
+        self.yaml_stat = [st.st_mtime_ns, st.st_size]
 
-        if self.expanded:
-            for scene in self.scenes:
-                buf.append('  {}'.format(scene['title']))
-                buf.append('   {}'.format(scene['descr']))
+        if os.path.exists(SNOWFLAKE_SCENES_SIDECAR):
+            with open(SNOWFLAKE_SCENES_SIDECAR, 'rb') as f:
+                try:
+                    sidecar = json.loads(f.read().decode('utf-8'))
+                except ValueError:
+                    sidecar = None
 
-    def build(self, snowflake):
-        """Compile the one-docs to one mega doc
+            if sidecar is not None and sidecar['yaml'] == self.yaml_stat and 'base' in sidecar:
+                self.base = sidecar['base']
+                return [entry_from_list(scene) for scene in sidecar['scenes']]
+
+        with open(SNOWFLAKE_SCENES_YAML, 'rb') as f:
+            data = f.read()
+
+        self.base = hashlib.sha1(data).hexdigest()
+        scenes = [entry_from_dict(scene) for scene in yaml_load(data) or ()]
+
+        self.save_sidecar(scenes, st, self.base)
+
+        return scenes
+
+    def replay(self):
+        """Apply the changes in the journal that haven't made it to the YAML yet: the ones
+        after the last {'base': hash} entry matching the YAML, see `flush()`.
+        Return True if the journal needs compacting.
+        """
+
+        if not os.path.exists(SNOWFLAKE_SCENES_JOURNAL):
+            return False
+
+        with open(SNOWFLAKE_SCENES_JOURNAL, 'rb') as f:
+            lines = f.read().splitlines()
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                # Torn by a crash while writing, nothing after this can be trusted
+                break
+
+        start = None
+        for i, entry in enumerate(entries):
+            # Journals of before the YAML was hashed have its [mtime, size] instead
+            if 'base' in entry and entry['base'] in (self.base, self.yaml_stat):
+                start = i
+
+        if start is None:
+            # Either compacted already, or the YAML has been replaced since
+            os.remove(SNOWFLAKE_SCENES_JOURNAL)
+            return False
+
+        for op in entries[start + 1:]:
+            if 'op' in op:
+                self.apply(op)
+
+        return True
+
+    def reload(self):
+        """Load the scene list again if the YAML has been changed by something else than
+        `flush()`, eg. `git pull`. What's in the YAML wins over changes not yet flushed.
+        Return True if it was loaded.
         """
 
-        out_filename = '{}.rst'.format(snowflake['info']['name'])
-        out_path = os.path.join(SNOWFLAKE_OUT_DIR, out_filename)
-        with open(out_path, 'wb') as out_f:
+        with self.lock:
+            if not os.path.exists(SNOWFLAKE_SCENES_YAML):
+                return False
+
+            st = os.stat(SNOWFLAKE_SCENES_YAML)
+            if self.yaml_stat == [st.st_mtime_ns, st.st_size]:
+                return False
+
+            # Chapters open in the menu stay open
+            expanded = set(scene.title for scene in self.scenes if scene.filename is None and scene.expanded)
+
+            self.scenes.reset(self.load())
+            self.totals = (0, 0, 0)
+
             for scene in self.scenes:
-                in_filename = scene['filename']
-                with open(in_filename, 'rb') as in_f:
-                    out_f.write(in_f.read())
-                    out_f.write(b'\n')
+                if scene.filename is None and scene.title in expanded:
+                    scene.expanded = True
+
+            # Unless the YAML is one `flush()` wrote, this only gets rid of the journal
+            self.replay()
+
+            self.refresh_scenes()
+
+        return True
+
+    def save_sidecar(self, scenes, st, base):
+        """Store `scenes` as a sidecar for the YAML file as it is in `st`, hashing to `base`
+        """
+
+        make_cache_dir()
+
+        sidecar = {
+            'yaml': [st.st_mtime_ns, st.st_size],
+            'base': base,
+            'scenes': [scene.to_list() for scene in scenes],
+        }
+
+        write_atomic(SNOWFLAKE_SCENES_SIDECAR, json.dumps(sidecar).encode('utf-8'))
+
+    def contribute_to_menu(self):
+        """Return the lines to show in the menu: the scenes before the first chapter,
+        then the chapters. The scenes of collapsed chapters are not even looked at.
+        """
+
+        lines = [(None, 'header')]
+
+        if not self.expanded:
+            return lines
+
+        with self.lock:
+            chapters = self.scenes.chapters()
+
+            for i in range(chapters[0] if chapters else len(self.scenes)):
+                lines.extend(((i, 'title'), (i, 'descr')))
+
+            for position in chapters:
+                lines.append((position, 'chapter'))
+
+                if self.scenes[position].expanded:
+                    for i in range(position + 1, self.scenes.chapter_end(position)):
+                        lines.extend(((i, 'title'), (i, 'descr')))
+
+        return lines
+
+    def menu_line(self, idx, kind):
+        """Return the text of a menu line, the scenes of chapters indented under them
+        """
+
+        if kind == 'header':
+            return '{}{} ({}w {}c {}p)'.format('-' if self.expanded else '+', self.title, *self.totals)
+
+        with self.lock:
+            if idx >= len(self.scenes):
+                # Gone since the menu was updated, another update is on its way
+                return ''
+
+            scene = self.scenes[idx]
+
+            if kind == 'chapter':
+                return '  {}{}{}'.format('-' if scene.expanded else '+', scene.title,
+                                         format_counts(self.chapter_counts(idx)))
 
-        cmd, suffix = CONVERSION
-        converted_path = out_path.rsplit('.', 1)[0] + suffix
+            indent = '  ' if self.scenes.chapter_of(idx) is None else '    '
 
-        retval = subprocess.call([cmd, out_path, converted_path])
+            if kind == 'title':
+                return '{}{}{}'.format(indent, scene.title, format_counts(scene.counts))
 
-        if retval != 0:
-            raise RuntimeError('Command failed')
+            return '{} {}'.format(indent, scene.descr)
+
+    def chapter_counts(self, idx):
+        """Return the sum of the counts of the scenes in the chapter at `idx`
+        """
+
+        counts = [scene.counts for scene in self.scenes.scenes[idx + 1:self.scenes.chapter_end(idx)]]
+
+        return tuple(sum(column) for column in zip(*(count for count in counts if count is not None))) or None
+
+    def toggle_chapter(self, idx):
+        """Show or hide the scenes of the chapter at `idx` in the menu
+        """
+
+        with self.lock:
+            chapter = self.scenes[idx]
+            chapter.expanded = not chapter.expanded
+
+    def variants(self, snowflake):
+        """Return output path -> [(filter, argument), ...] for each build configured under
+        `builds` in `snowflake`, eg.
+
+            builds:
+              draft: []
+              clean: [drop-header, strip-comments, {separators: '~~~~'}]
+
+        Without any, there's one build of the scenes as they are.
+        """
+
+        name = snowflake['info']['name']
+        builds = snowflake.get('builds')
+        if not builds:
+            return OrderedDict(((os.path.join(SNOWFLAKE_OUT_DIR, '{}.rst'.format(name)), []),))
+
+        variants = OrderedDict()
+        for variant, filters in builds.items():
+            chain = []
+            for entry in filters or ():
+                if isinstance(entry, dict):
+                    (filter_name, arg), = entry.items()
+                else:
+                    filter_name, arg = entry, None
+
+                if filter_name not in BUILD_FILTERS:
+                    raise ValueError('Unknown filter {} in build {}'.format(filter_name, variant))
+
+                if filter_name == 'separators' and arg is not None and not RST_TRANSITION.fullmatch(str(arg)):
+                    raise ValueError('Separator {!r} in build {} is not a transition'.format(arg, variant))
+
+                chain.append((filter_name, arg))
+
+            variants[os.path.join(SNOWFLAKE_OUT_DIR, '{}-{}.rst'.format(name, variant))] = chain
+
+        return variants
+
+    def build(self, snowflake, manifest):
+        """Compile the scenes to one mega doc per build variant, with a heading for each chapter.
+        Scenes are streamed into the documents: copied as they are by the kernel for variants
+        without filters, and a line at a time through the filters of the others. Only the
+        documents whose contents changed are converted.
+        """
+
+        with self.lock:
+            entries = [(scene.title, scene.filename) for scene in self.scenes]
+
+        in_filenames = [filename for title, filename in entries if filename is not None]
+
+        # Where each chapter starts, as the number of scenes before it
+        outline = []
+        scenes_before = 0
+        for title, filename in entries:
+            if filename is None:
+                outline.append([scenes_before, title])
+            else:
+                scenes_before += 1
+
+        outputs = []
+        for out_path, chain in self.variants(snowflake).items():
+            # The filters go in the outline, so changing them rebuilds
+            layout = json.dumps([outline, chain]) if outline or chain else None
+            reason = manifest.check(out_path, in_filenames, outline=layout)
+            if reason is not None:
+                outputs.append((out_path, chain, reason, open(out_path + '.tmp', 'wb'), hashlib.sha1(), []))
+
+        if not outputs:
+            return []
+
+        # Bytes written to each output so far, where its next part starts
+        offsets = [0] * len(outputs)
+
+        def write(i, data):
+            outputs[i][3].write(data)
+            outputs[i][4].update(data)
+            offsets[i] += len(data)
+
+        try:
+            position = 0
+            for title, filename in entries:
+                if filename is None:
+                    rule = len(title.encode('utf-8')) * b'='
+                    heading = b'\n'.join((rule, title.encode('utf-8'), rule)) + b'\n\n'
+                    for i, (out_path, chain, reason, out_f, sha, parts) in enumerate(outputs):
+                        write(i, heading)
+                        parts.append(('chapter', title))
+
+                    position = 0
+                    continue
+
+                for i, (out_path, chain, reason, out_f, sha, parts) in enumerate(outputs):
+                    start = offsets[i]
+
+                    if chain:
+                        # Each filtered variant reads the scene again, rather than holding it all
+                        with open(filename, 'rb') as f:
+                            lines = f
+                            for filter_name, arg in chain:
+                                lines = BUILD_FILTERS[filter_name](lines, position, arg)
+
+                            for line in lines:
+                                write(i, line)
+                    else:
+                        # The hash of the scene stands for its bytes in the hash of the output
+                        offsets[i] += copy_into(out_f, filename)
+                        sha.update(manifest.digest(filename).encode('utf-8'))
+
+                    # Each scene is parsed on its own when converting, see `publish()`
+                    parts.append(('text', start, offsets[i], filename))
+                    write(i, b'\n')
+
+                position += 1
+        finally:
+            for out_path, chain, reason, out_f, sha, parts in outputs:
+                out_f.close()
+
+        rebuilt = []
+        for out_path, chain, reason, out_f, sha, parts in outputs:
+            if manifest.content_changed(out_path, sha.hexdigest()):
+                os.replace(out_path + '.tmp', out_path)
+                rebuilt.append((out_path, reason, parts))
+            else:
+                # Same as what was converted last time, eg. only comments changed
+                os.remove(out_path + '.tmp')
+                manifest.record(out_path)
+
+        return rebuilt
 
     def refresh_scenes(self):
         """When editing the title or description of a file, the
         scenes list metadata should be updated as well.
         To ensure this can happen, the fields must be in the files.
+        Only the files changed since their last read are actually read.
         """
 
+        changed = False
         for scene in self.scenes:
-            self.refresh_scene(scene, save=False)
+            if scene.filename is None:
+                continue
+
+            if os.path.exists(scene.filename) and self.refresh_stale(scene, save=False):
+                changed = True
+
+        if changed:
+            self.save()
+
+        self.cache.save()
+
+    def refresh_files(self, filenames):
+        """Refresh only the scenes stored in `filenames`, eg. after they were written.
+        Nothing is read if a file's mtime and size are what they were the last time.
+        Return True if any title, description or counts changed.
+        """
+
+        changed = False
 
-        self.save()
+        with self.lock:
+            for filename in filenames:
+                scene = self.scenes.get(filename)
+                if scene is None or not os.path.exists(scene.filename):
+                    # Not a scene, or removed from under us and hopefully from the YAML next
+                    continue
+
+                counts = scene.counts
+                if self.refresh_stale(scene) or scene.counts != counts:
+                    changed = True
+
+            self.cache.save()
+
+        return changed
+
+    def refresh_stale(self, scene, save=True):
+        """Like `refresh_scene()`, but take the title and description from the cache
+        if the file has not changed since it was last read.
+        """
+
+        st = os.stat(scene.filename)
+        entry = self.cache.get(normalize_path(scene.filename), st)
+        if entry is None or 'words' not in entry:
+            return self.refresh_scene(scene, save=save)
+
+        self.set_counts(scene, (entry['words'], entry['chars'], entry['paragraphs']))
+
+        if (entry['title'], entry['descr']) == (scene.title, scene.descr):
+            return False
+
+        self.mutate({
+            'op': 'update', 'filename': scene.filename, 'title': entry['title'], 'descr': entry['descr'],
+        }, save=save)
+
+        return True
 
     def refresh_scene(self, scene, save=True):
         """Verify internal format of a scene. If it needs to be changed,
         always write it to disk.
-        By default, save the `self.scenes` yaml.
+        By default, save the `self.scenes` yaml if the title or description changed.
+        Return True if they did.
         """
 
         changed = False
 
-        filename = scene['filename']
+        filename = scene.filename
         with open(filename, 'rb') as f:
             lines = f.readlines()
             top_lines = lines[:2]
 
-        comment_count = len([l for l in top_lines if l.startswith(b'.. ')])
+        comment_count = len([l for l in top_lines if l.startswith(b'.. ')])
+
+        # Magic 2: one for title, one for description
+        to_add = 2 - comment_count
+        for i in range(to_add):
+            lines.insert(i, b'.. \n')
+            changed = True
+
+        if lines[2] != b'\n':
+            lines.insert(2, b'\n')
+            changed = True
+
+        title = lines[0].replace(b'.. ', b'').strip().decode('utf-8')
+        descr = lines[1].replace(b'.. ', b'').strip().decode('utf-8')
+
+        if changed:
+            with open(filename, 'wb') as f:
+                f.write(b''.join(lines))
+
+        counts = count_text(lines)
+        self.set_counts(scene, counts)
+
+        st = os.stat(filename)
+        self.cache.set(normalize_path(filename), st, title=title, descr=descr,
+                       words=counts[0], chars=counts[1], paragraphs=counts[2])
+
+        if (title, descr) == (scene.title, scene.descr):
+            return False
+
+        self.mutate({'op': 'update', 'filename': filename, 'title': title, 'descr': descr}, save=save)
+
+        return True
+
+    def set_counts(self, scene, counts):
+        """Update the counts of `scene`, and the totals with them
+        """
+
+        old = scene.counts or (0, 0, 0)
+        self.totals = tuple(total - before + after for total, before, after in zip(self.totals, old, counts))
+        scene.counts = counts
+
+    def add_at(self, idx, nvim):
+        """Add an entry at given list index (0-indexed)
+        """
+
+        import uuid
+
+        fname = '{}.rst'.format(uuid.uuid4())
+        fname = os.path.join(SNOWFLAKE_SCENES_DIR, fname)
+
+        title = nvim.funcs.input('Scene title> ')
+        descr = nvim.funcs.input('Scene description> ')
+
+        if not self.scenes:
+            assert idx == 0
+        else:
+            assert idx >= 0
+
+        with open(fname, 'wb') as f:
+            f.writelines((
+                '.. {}\n'.format(title).encode('utf-8'),
+                '.. {}\n'.format(descr).encode('utf-8'),
+                b'\n',
+            ))
+
+        self.mutate({'op': 'insert', 'idx': idx, 'scene': [title, descr, fname]})
+
+    def add_chapter_at(self, idx, nvim):
+        """Start a chapter at given list index (0-indexed), taking in the scenes after it
+        """
+
+        title = nvim.funcs.input('Chapter title> ')
+        if not title:
+            return
+
+        self.mutate({'op': 'insert', 'idx': idx, 'scene': [title]})
+
+        # Don't hide the scenes it took in
+        self.toggle_chapter(idx)
+
+    def apply(self, op):
+        """Apply a change to the scene list, see `mutate()`
+        """
+
+        if op['op'] == 'insert':
+            self.scenes.insert(op['idx'], entry_from_list(op['scene']))
+        elif op['op'] == 'move':
+            self.scenes.move(op['from'], op['to'])
+        elif op['op'] == 'delete':
+            scene = self.scenes.pop(op['idx'])
+            if scene.counts is not None:
+                self.set_counts(scene, (0, 0, 0))
+        elif op['op'] == 'update':
+            scene = self.scenes.get(op['filename'])
+            scene.title = op['title']
+            scene.descr = op['descr']
+        elif op['op'] == 'batch':
+            # All or nothing
+            scenes, totals = list(self.scenes), self.totals
+            counts = [scene.counts for scene in scenes]
+            try:
+                for each in op['ops']:
+                    self.apply(each)
+            except Exception:
+                self.scenes.reset(scenes)
+                for scene, scene_counts in zip(scenes, counts):
+                    if scene.filename is not None:
+                        scene.counts = scene_counts
+                self.totals = totals
+                raise
+        else:
+            raise ValueError('Unknown scene list change {}'.format(op['op']))
+
+    def mutate(self, op, save=True):
+        """Apply a change to the scene list. With `save`, the change is also appended to
+        the journal and synced to disk, and later compacted into the YAML by `flush()`.
+        """
+
+        with self.lock:
+            self.apply(op)
+
+            if save:
+                with open(SNOWFLAKE_SCENES_JOURNAL, 'ab') as f:
+                    if f.tell() == 0:
+                        f.write(json.dumps({'base': self.base}).encode('utf-8') + b'\n')
+
+                    f.write(json.dumps(op).encode('utf-8') + b'\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        if save:
+            self.save()
+
+    def save(self):
+        """Flush the thing to disk soon, see `flush()`
+        """
+
+        self.saver.schedule()
+
+    def flush(self):
+        """Flush the thing to disk, compacting the journal into the YAML. Before the YAML
+        is replaced, the journal gets a {'base': hash of the new YAML} entry after the
+        changes in it, so whichever YAML a crash leaves, `replay()` knows what to apply.
+        """
+
+        with self.lock:
+            scenes = [scene.copy() for scene in self.scenes]
+            journaled = os.path.getsize(SNOWFLAKE_SCENES_JOURNAL) if os.path.exists(SNOWFLAKE_SCENES_JOURNAL) else 0
+
+        data = yaml_dump(scenes)
+        base = hashlib.sha1(data).hexdigest()
+        checkpoint = json.dumps({'base': base}).encode('utf-8') + b'\n'
+
+        with self.lock:
+            if os.path.exists(SNOWFLAKE_SCENES_JOURNAL):
+                with open(SNOWFLAKE_SCENES_JOURNAL, 'rb') as f:
+                    journal = f.read()
+            else:
+                journal = json.dumps({'base': self.base}).encode('utf-8') + b'\n'
+
+            write_atomic(SNOWFLAKE_SCENES_JOURNAL, journal[:journaled] + checkpoint + journal[journaled:], sync=True)
+
+        write_atomic(SNOWFLAKE_SCENES_YAML, data, sync=True)
+        st = os.stat(SNOWFLAKE_SCENES_YAML)
+
+        with self.lock:
+            self.base = base
+            self.yaml_stat = [st.st_mtime_ns, st.st_size]
+
+            # Whatever got journaled while writing the YAML now applies on top of the new one
+            with open(SNOWFLAKE_SCENES_JOURNAL, 'rb') as f:
+                f.seek(journaled + len(checkpoint))
+                # Leaving out the header `mutate()` starts a new journal with
+                rest = [line for line in f if b'"op"' in line]
+
+            if rest:
+                write_atomic(SNOWFLAKE_SCENES_JOURNAL, checkpoint + b''.join(rest), sync=True)
+            else:
+                os.remove(SNOWFLAKE_SCENES_JOURNAL)
+
+            # Under the lock, as `reload()` may be writing one for a YAML changed outside Neovim
+            self.save_sidecar(scenes, st, base)
+
+    def transaction(self, ops):
+        """Apply `ops` as one change: if one fails none are applied, and they're journaled
+        and saved together
+        """
+
+        if ops:
+            self.mutate({'op': 'batch', 'ops': ops})
+
+    def block(self, entries):
+        """Return the (first, last) positions the menu `entries`, (idx, kind) pairs, cover,
+        a collapsed chapter with its scenes
+        """
+
+        with self.lock:
+            first = min(idx for idx, kind in entries)
+            last = max(self.scenes.chapter_end(idx) - 1 if kind == 'chapter' and not self.scenes[idx].expanded else idx
+                       for idx, kind in entries)
+
+        return first, last
 
-        # Magic 2: one for title, one for description
-        to_add = 2 - comment_count
-        for i in range(to_add):
-            lines.insert(i, b'.. \n')
-            changed = True
+    def move_block(self, first, last, steps):
+        """Move the entries from `first` to `last` by `steps`, as far as they can go.
+        Return where the first one ends up.
+        """
 
-        if lines[2] != b'\n':
-            lines.insert(2, b'\n')
-            changed = True
+        with self.lock:
+            if steps > 0:
+                steps = min(steps, len(self.scenes) - 1 - last)
+                # What's after the block goes before it
+                ops = [{'op': 'move', 'from': last + k, 'to': first + k - 1} for k in range(1, steps + 1)]
+            else:
+                steps = -min(-steps, first)
+                ops = [{'op': 'move', 'from': first - k, 'to': last - k + 1} for k in range(1, 1 - steps)]
 
-        scene['title'] = lines[0].replace(b'.. ', b'').strip().decode('utf-8')
-        scene['descr'] = lines[1].replace(b'.. ', b'').strip().decode('utf-8')
+            self.transaction(ops)
 
-        if changed:
-            with open(filename, 'wb') as f:
-                f.write(b''.join(lines))
+        return first + steps
 
-        if save:
-            self.save()
+    def remove_block(self, first, last):
+        """Take the entries from `first` to `last` out of the list. The scene files stay.
+        """
 
-    def add_at(self, idx, nvim):
-        """Add an entry at given list index (0-indexed)
+        self.transaction([{'op': 'delete', 'idx': idx} for idx in range(last, first - 1, -1)])
+
+    def import_files(self, paths, idx):
+        """Copy the RST files `paths` in as scenes at `idx`. Files without the title and
+        description comments get them, titled by their file name. Return the new scene files.
         """
 
-        fname = '{}.rst'.format(uuid.uuid4())
-        fname = os.path.join(SNOWFLAKE_SCENES_DIR, fname)
+        import uuid
 
-        title = nvim.funcs.input('Scene title> ')
-        descr = nvim.funcs.input('Scene description> ')
-        scene = OrderedDict((
-            ('title', title),
-            ('descr', descr),
-            ('filename', fname),
-        ))
+        ops = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                lines = f.readlines()
 
-        if not self.scenes:
-            assert idx == 0
-        else:
-            assert idx >= 0
+            if len(lines) < 2 or not (lines[0].startswith(b'.. ') and lines[1].startswith(b'.. ')):
+                title = os.path.splitext(os.path.basename(path))[0]
+                lines[:0] = ['.. {}\n'.format(title).encode('utf-8'), b'.. \n', b'\n']
 
-        self.scenes.insert(idx, scene)
+            fname = os.path.join(SNOWFLAKE_SCENES_DIR, '{}.rst'.format(uuid.uuid4()))
+            with open(fname, 'wb') as f:
+                f.writelines(lines)
 
-        with open(fname, 'wb') as f:
-            f.writelines((
-                '.. {}\n'.format(scene['title']).encode('utf-8'),
-                '.. {}\n'.format(scene['descr']).encode('utf-8'),
-                b'\n',
-            ))
+            title = lines[0][3:].strip().decode('utf-8', 'replace')
+            descr = lines[1][3:].strip().decode('utf-8', 'replace')
+            ops.append({'op': 'insert', 'idx': idx + len(ops), 'scene': [title, descr, fname]})
 
-        self.save()
+        self.transaction(ops)
 
-    def save(self):
-        """Flush the thing to disk
-        """
+        with self.lock:
+            for op in ops:
+                self.refresh_scene(self.scenes[op['idx']])
+            self.cache.save()
 
-        with open(SNOWFLAKE_SCENES_YAML, 'wb') as f:
-            f.write(yaml.dump(self.scenes).encode('utf-8'))
+        return [op['scene'][2] for op in ops]
 
     def move(self, from_idx, to_idx):
         """Move a list entry
@@ -307,9 +2741,25 @@ class SceneManager(Manager):
         assert from_idx >= 0
         assert to_idx >= 0
 
-        self.scenes.insert(to_idx, self.scenes.pop(from_idx))
+        self.mutate({'op': 'move', 'from': from_idx, 'to': to_idx})
+
+    def get_counts(self, filename):
+        """Return the counts of `filename` if it's one of ours and it has been counted
+        """
+
+        with self.lock:
+            scene = self.scenes.get(filename)
 
-        self.save()
+            return scene.counts if scene is not None else None
+
+    def describe_file(self, filename):
+        """Return (position, title) of `filename` if it's one of ours, to show it by
+        """
+
+        with self.lock:
+            scene = self.scenes.get(filename)
+
+            return (self.scenes.position(filename), scene.title) if scene is not None else None
 
     def get_file_by_idx(self, idx):
         """Look at the scene list and return the relevant file name
@@ -318,7 +2768,7 @@ class SceneManager(Manager):
         if self.scenes:
             scene = self.scenes[idx]
 
-            return scene['filename']
+            return scene.filename
 
 
 @neovim.plugin
@@ -338,33 +2788,56 @@ class SnowflakePlugin(object):
         ('copyright-year', 'Copyright year> '),
     ))
 
-    managers = OrderedDict((
-        ('snowflake', SnowflakeManager()),
-        ('scene', SceneManager()),
-    ))
-
     def __init__(self, nvim):
+        """Only set initial data. This happens whenever the plugin host starts, so anything
+        touching the disk or Neovim is left for `init_snowflake()`.
+        """
+
         self.inited = False
 
         self.nvim = nvim
-        self.manager = self.managers['snowflake']
 
-        self.snowflake = OrderedDict()
-        self.snowflake['info'] = self.initial_info
-        self.snowflake['file-list'] = OrderedDict((
-            ('snowflake', self.managers['snowflake'].snowflake_files),
-            ('scenes', self.managers['scene'].scenes),
-        ))
+        # Set up by `init_snowflake()`
+        self.managers = None
+        self.manager = None
+        self.snowflake = None
+        self.session_log = None
+        self.search_index = None
+
+        # Filename -> when insert mode was entered in it
+        self.insert_started = {}
+
+        # Set by `:SnowflakeProfile start` or `g:snowflake_profile`, see `profiled()`
+        self.profiler = None
 
         self.menu_win_handle = None
 
-        # I use MiniBufExplorer, but not here
-        self.nvim.vars['miniBufExplAutoStart'] = 0
+        # What each menu line shows, and its text as currently in the menu buffer, to only
+        # send the changes. None for lines not rendered since they last changed, see `update_menu()`.
+        self.menu_items = [MenuItem(None, None, None)]
+        self.menu_lines = ['']
 
-        # Initial menu position
-        self.nvim.vars['menu_pos'] = [0, 1, 1, 0]
+        # First and last visible menu lines
+        self.menu_view = (1, MENU_PAGE)
+
+        # Written files are refreshed in batches on a worker thread, whoever wrote them
+        self.refresher = Debouncer(REFRESH_DELAY, self.refresh_files)
+        self.watcher = None
+
+        # Normalized filenames written in Neovim and not refreshed yet, the only ones whose
+        # words go in the session log rather than eg. those of a `git pull`
+        self.written = set()
+        self.written_lock = threading.Lock()
+
+        # Builds run on their own thread, conversions in parallel in the converter
+        self.build_lock = threading.Lock()
+        self.converter = Converter()
+
+        # Set by `:SnowflakeBuildWatch`, rebuilds a moment after files are written
+        self.build_watch = None
 
     @neovim.command('Snowflake', range='', nargs='*')
+    @profiled
     def init_snowflake(self, args, range):
         """Set the current environment up for working
         """
@@ -373,6 +2846,32 @@ class SnowflakePlugin(object):
         if self.inited:
             return
 
+        # I use MiniBufExplorer, but not here
+        self.nvim.vars['miniBufExplAutoStart'] = 0
+
+        # Initial menu position
+        self.nvim.vars['menu_pos'] = [0, 1, 1, 0]
+
+        if self.profiler is None and self.nvim.vars.get('snowflake_profile'):
+            self.profiler = Profiler(self.nvim)
+
+        cache = FileCache(SNOWFLAKE_FILE_CACHE)
+        self.managers = OrderedDict((
+            ('snowflake', SnowflakeManager(cache)),
+            ('scene', SceneManager(cache)),
+        ))
+        self.manager = self.managers['snowflake']
+
+        self.session_log = SessionLog(SNOWFLAKE_SESSION_LOG, SNOWFLAKE_SESSION_STATS)
+        self.search_index = SearchIndex(SNOWFLAKE_SEARCH_INDEX)
+
+        self.snowflake = OrderedDict()
+        self.snowflake['info'] = OrderedDict(self.initial_info)
+        self.snowflake['file-list'] = OrderedDict((
+            ('snowflake', self.managers['snowflake'].snowflake_files),
+            ('scenes', self.managers['scene'].scenes),
+        ))
+
         if not os.path.exists(SNOWFLAKE_RST_DIR):
             os.mkdir(SNOWFLAKE_RST_DIR)
 
@@ -384,6 +2883,8 @@ class SnowflakePlugin(object):
                 with open(snowflake_file, 'wb') as f:
                     f.write(self.managers['snowflake'].snowflake_defaults[key].encode('utf-8'))
 
+        self.managers['snowflake'].refresh_counts()
+
         if os.path.exists(SNOWFLAKE_YAML):
             self.load_snowflake()
 
@@ -392,35 +2893,164 @@ class SnowflakePlugin(object):
 
         self.make_menu_pane()
         self.update_menu()
-        self.manager.set_layout(self.nvim)
+        self.use_layout(self.manager)
+
+        self.watcher = Watcher([SNOWFLAKE_SCENES_DIR, SNOWFLAKE_RST_DIR], [SNOWFLAKE_SCENES_YAML],
+                               lambda filenames: self.refresher.schedule(*filenames))
+        self.watcher.start()
+
+        thread = threading.Thread(target=self.search_index.load, args=(self.search_files(),), name='snowflake-search')
+        thread.daemon = True
+        thread.start()
 
         self.inited = True
 
     @neovim.command('SnowflakeBuild', nargs=0)
+    @profiled
     def build_snowflake(self):
-        """Build documents
+        """Build documents in the background, see `run_build()`
         """
 
         # XXX: Could change to nargs=1 and have config files
         #      or maybe just have one config file
 
-        for manager in self.managers.values():
-            manager.build(self.snowflake)
+        if not self.inited:
+            return
+
+        if not self.build_lock.acquire(blocking=False):
+            self.nvim.out_write('Snowflake: a build is already running\n')
+            return
+
+        thread = threading.Thread(target=self.run_build, name='snowflake-build')
+        thread.daemon = True
+        thread.start()
+
+    @neovim.command('SnowflakeBuildWatch', nargs='?')
+    @profiled
+    def build_watch_snowflake(self, args):
+        """Keep the documents built: rebuild in the background a moment after files are
+        written, until `:SnowflakeBuildWatch stop`
+        """
+
+        if not self.inited:
+            return
+
+        if args and args[0] == 'stop':
+            if self.build_watch is not None:
+                self.build_watch.cancel()
+                self.build_watch = None
+                self.nvim.out_write('Snowflake: no longer rebuilding on writes\n')
+            return
+
+        if self.build_watch is None:
+            self.build_watch = Debouncer(BUILD_WATCH_DELAY, lambda filenames: self.watch_build())
+            self.nvim.out_write('Snowflake: rebuilding on writes, stop with :SnowflakeBuildWatch stop\n')
+
+        # Start off up to date
+        self.build_watch.schedule()
+
+    def watch_build(self):
+        """Rebuild for `:SnowflakeBuildWatch`, on the watch's worker thread
+        """
+
+        if not self.build_lock.acquire(blocking=False):
+            # Go again after the running build, it may have missed the latest writes
+            build_watch = self.build_watch
+            if build_watch is not None:
+                build_watch.schedule()
+            return
+
+        self.run_build(quiet=True)
+
+    @profiled
+    def run_build(self, quiet=False):
+        """Write the documents of all managers and convert them all in parallel,
+        reporting each one to Neovim as it finishes. Runs on a build thread.
+        With `quiet`, there's nothing to say if everything is up to date.
+        """
+
+        def report(message, error=False):
+            write = self.nvim.err_write if error else self.nvim.out_write
+            self.nvim.async_call(write, 'Snowflake: {}\n'.format(message))
+
+        started = time.time()
+
+        try:
+            formats = self.snowflake.get('formats') or ['odt']
+            unknown = [fmt for fmt in formats if fmt not in BUILD_FORMATS]
+            if unknown:
+                report('unknown formats {}, use {}'.format(', '.join(unknown), ', '.join(BUILD_FORMATS)), error=True)
+                return
+
+            manifest = BuildManifest(SNOWFLAKE_BUILD_MANIFEST, formats)
+
+            jobs = []
+            for manager in self.managers.values():
+                jobs.extend(manager.build(self.snowflake, manifest))
+
+            if not jobs:
+                # Outputs may have been found the same as converted before even so
+                manifest.save()
+                if not quiet:
+                    report('everything is up to date')
+                return
+
+            futures = dict((self.converter.submit(path, parts, formats), (path, reason))
+                           for path, reason, parts in jobs)
+
+            failed = 0
+            for future in concurrent.futures.as_completed(futures):
+                path, reason = futures[future]
+
+                try:
+                    messages = future.result() or []
+                except concurrent.futures.BrokenExecutor as e:
+                    failed += 1
+                    report('failed to convert {}: {}'.format(path, e), error=True)
+                    self.converter.reset()
+                except RuntimeError as e:
+                    failed += 1
+                    report('failed to convert {}: {}'.format(path, e), error=True)
+                else:
+                    manifest.record(path)
+                    report('rebuilt {} in {:.1f}s ({})'.format(', '.join(converted_path(path, fmt) for fmt in formats),
+                                                                time.time() - started, reason))
+
+                    for message in messages[:BUILD_MESSAGES]:
+                        report(message, error=True)
+                    if len(messages) > BUILD_MESSAGES:
+                        report('{} more warnings about {}'.format(len(messages) - BUILD_MESSAGES, path), error=True)
+
+            # Only what got converted is recorded, failures are retried next time
+            manifest.save()
+            prune_doctrees()
+
+            if failed:
+                report('{} of {} documents failed'.format(failed, len(jobs)), error=True)
+        except Exception as e:
+            report('build failed: {}'.format(e), error=True)
+        finally:
+            self.build_lock.release()
 
     @neovim.function('SnowflakeToggleMenu', sync=True)
+    @profiled
     def toggle_menu(self, args):
         """Menu toggler
         """
 
         menu_stat = self.menu_stat()
 
-        if menu_stat.manager is not None:
+        if menu_stat.kind == 'chapter' and callable(getattr(menu_stat.manager, 'toggle_chapter', None)):
+            menu_stat.manager.toggle_chapter(menu_stat.idx)
+
+            self.update_menu(menu_stat)
+        elif menu_stat.manager is not None:
             menu_stat.manager.expanded = not menu_stat.manager.expanded
-            self.update_menu()
 
-            self.nvim.funcs.cursor(menu_stat.line, menu_stat.col)
+            self.update_menu(menu_stat)
 
     @neovim.function('SnowflakeSetLayout', sync=True)
+    @profiled
     def set_layout(self, args):
         """Set layout based on current menu
         """
@@ -428,11 +3058,11 @@ class SnowflakePlugin(object):
         menu_stat = self.menu_stat()
 
         if menu_stat.manager is not None:
-            self.clean_windows()
-            menu_stat.manager.set_layout(self.nvim)
+            self.use_layout(menu_stat.manager)
             self.update_menu()
 
     @neovim.function('SnowflakePrependScene', sync=True)
+    @profiled
     def prepend_scene(self, args):
         """Add a scene above cursor
         """
@@ -440,12 +3070,10 @@ class SnowflakePlugin(object):
         menu_stat = self.menu_stat()
 
         # Be lazy and deny prepending in an empty list, use append instead
-        if menu_stat.offset == 0:
+        if menu_stat.kind not in ('title', 'descr', 'chapter'):
             return
 
-        idx = menu_stat.offset - 1 if menu_stat.offset > 0 else menu_stat.offset
-
-        idx //= 2
+        idx = menu_stat.idx
 
         if callable(getattr(menu_stat.manager, 'add_at', None)):
             menu_stat.manager.add_at(idx, self.nvim)
@@ -453,21 +3081,28 @@ class SnowflakePlugin(object):
             if not menu_stat.manager.expanded:
                 menu_stat.manager.expanded = True
 
-            self.update_menu(menu_stat)
+            # Above a chapter line, the scene ends the chapter before it, which may be collapsed
+            chapter = menu_stat.manager.scenes.chapter_of(idx)
+            if chapter is not None and not menu_stat.manager.scenes[chapter].expanded:
+                menu_stat.manager.toggle_chapter(chapter)
+
+            # The cursor goes to the new scene, which took the place of whatever line it was on
+            self.update_menu(menu_stat._replace(kind='title'))
 
     @neovim.function('SnowflakeAppendScene', sync=True)
+    @profiled
     def append_scene(self, args):
         """Add a scene
         """
 
         menu_stat = self.menu_stat()
 
-        if menu_stat.offset > 0 and menu_stat.offset % 2 == 1:
-            idx = menu_stat.offset + 1
+        if menu_stat.kind in ('title', 'descr', 'chapter'):
+            idx = menu_stat.idx + 1
+        elif menu_stat.kind == 'header':
+            idx = 0
         else:
-            idx = menu_stat.offset
-
-        idx //= 2
+            return
 
         if callable(getattr(menu_stat.manager, 'add_at', None)):
             menu_stat.manager.add_at(idx, self.nvim)
@@ -475,9 +3110,36 @@ class SnowflakePlugin(object):
             if not menu_stat.manager.expanded:
                 menu_stat.manager.expanded = True
 
+            if menu_stat.kind == 'chapter' and not menu_stat.manager.scenes[menu_stat.idx].expanded:
+                menu_stat.manager.toggle_chapter(menu_stat.idx)
+
             self.update_menu(menu_stat)
 
+    @neovim.function('SnowflakeAddChapter', sync=True)
+    @profiled
+    def add_chapter(self, args):
+        """Start a chapter above cursor
+        """
+
+        menu_stat = self.menu_stat()
+
+        if menu_stat.kind in ('title', 'descr', 'chapter'):
+            idx = menu_stat.idx
+        elif menu_stat.kind == 'header':
+            idx = 0
+        else:
+            return
+
+        if callable(getattr(menu_stat.manager, 'add_chapter_at', None)):
+            menu_stat.manager.add_chapter_at(idx, self.nvim)
+
+            if not menu_stat.manager.expanded:
+                menu_stat.manager.expanded = True
+
+            self.update_menu(menu_stat._replace(idx=idx, kind='chapter'))
+
     @neovim.function('SnowflakeMoveScene', sync=True)
+    @profiled
     def move_scene(self, args):
         """Move a scene above cursor
         """
@@ -489,73 +3151,260 @@ class SnowflakePlugin(object):
         menu_stat = self.menu_stat()
 
         # Do nothing with a list too small, or a bad position
-        if menu_stat.offset < 3 and direction == -1:
+        if menu_stat.kind not in ('title', 'descr', 'chapter') or (menu_stat.idx == 0 and direction == -1):
             return
 
-        idx = menu_stat.offset - 1 if menu_stat.offset > 0 else menu_stat.offset
-
-        idx //= 2
+        idx = menu_stat.idx
 
         if callable(getattr(menu_stat.manager, 'move', None)):
             dst_idx = idx + direction
-            menu_stat.manager.move(idx, idx + direction)
+            menu_stat.manager.move(idx, dst_idx)
+
+            # Have the cursor follow the scene
+            self.update_menu(menu_stat._replace(idx=dst_idx))
+
+    @neovim.function('SnowflakeMoveScenes', range=True, sync=True)
+    @profiled
+    def move_scenes(self, args, range):
+        """Move the scenes on the selected menu lines by the given number of steps, in one go
+        """
+
+        assert len(args) == 1
+
+        block = self.menu_block(range)
+        if block is None or not callable(getattr(block[0], 'move_block', None)):
+            return
+
+        manager, item, (first, last) = block
+        moved = manager.move_block(first, last, args[0]) - first
+
+        # Have the cursor follow the scenes
+        self.update_menu(MenuStat(manager, item.idx + moved, item.kind, range[0], 0))
+
+    @neovim.function('SnowflakeRemoveScenes', range=True, sync=True)
+    @profiled
+    def remove_scenes(self, args, range):
+        """Take the scenes on the selected menu lines out of the list, in one go
+        """
+
+        block = self.menu_block(range)
+        if block is None or not callable(getattr(block[0], 'remove_block', None)):
+            return
+
+        manager, item, (first, last) = block
+        answer = self.nvim.funcs.input('Remove {} from the list, keeping the files? [y/N] '.format(last - first + 1))
+        if answer.lower() != 'y':
+            return
 
-            # Forge a new MenuStat to track the cursor
-            self.update_menu(MenuStat(menu_stat.manager, 1 + (2 * dst_idx), menu_stat.line, menu_stat.col))
+        manager.remove_block(first, last)
+        self.update_menu(MenuStat(manager, first, item.kind, range[0], 0))
+
+    @neovim.command('SnowflakeImportScenes', nargs=1, complete='dir')
+    @profiled
+    def import_scenes(self, args):
+        """Add the RST files in a directory to the end of the scene list, in file name order
+        """
+
+        if not self.inited:
+            return
+
+        directory = os.path.expanduser(args[0])
+        try:
+            paths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.rst'))
+        except OSError as e:
+            self.nvim.err_write('Snowflake: cannot import {}: {}\n'.format(directory, e))
+            return
+
+        manager = self.managers['scene']
+        filenames = manager.import_files(paths, len(manager.scenes))
+
+        self.search_index.update([normalize_path(filename) for filename in filenames])
+        self.update_menu()
+        self.nvim.out_write('Snowflake: imported {} scenes from {}\n'.format(len(filenames), directory))
 
     @neovim.function('SnowflakeEditScene', sync=True)
+    @profiled
     def edit_scene(self, args):
         """Open a scene file for editing
         """
 
         menu_stat = self.menu_stat()
 
-        self.clean_windows()
-        menu_stat.manager.set_layout(self.nvim)
+        if menu_stat.manager is None:
+            return
+
+        window = self.use_layout(menu_stat.manager)
         self.update_menu()
 
-        # Do some trickery to get from vim's line numbers
-        # for titles and descriptions to the actual structure
-        if menu_stat.offset == 0:
+        if menu_stat.kind not in ('title', 'descr'):
             # Don't allow editing when there's nothing to edit
             return
-        else:
-            idx = menu_stat.offset - 1
-
-        idx //= 2
-
-        for window in self.nvim.windows:
-            if window.handle != self.menu_win_handle:
-                break
-        else:
-            window = None
 
-        if window is not None:
-            # Pass as a dummy value to ensure the correct layout here
-            # self.set_layout(None)
+        idx = menu_stat.idx
 
-            if callable(getattr(menu_stat.manager, 'get_file_by_idx', None)):
-                fname = menu_stat.manager.get_file_by_idx(idx)
-                if fname is not None:
-                    self.nvim.command('{} wincmd w'.format(window.number))
-                    self.nvim.command('edit {}'.format(fname))
+        if callable(getattr(menu_stat.manager, 'get_file_by_idx', None)):
+            fname = menu_stat.manager.get_file_by_idx(idx)
+            if fname is not None:
+                call_atomic(self.nvim, [
+                    ('nvim_set_current_win', [window]),
+                    ('nvim_command', ['edit {}'.format(fname)]),
+                ])
 
-    @neovim.autocmd('BufWritePost', pattern='*.rst', eval='expand("<afile>")', sync=True)
+    @neovim.autocmd('BufWritePost', pattern='*.rst', eval='expand("<afile>")')
+    @profiled
     def on_bufwritepost_updatemenu(self, filename):
         """Update menu and all that, but only if Snowflake has been inited. Otherwise this
         will get called when saving RST files outside Snowflake, causing weirdness.
+        The actual work is done by `refresh_files()` a moment later, so saving never waits
+        for it and a burst of writes, eg. `:wa`, gets refreshed in one go.
         """
 
         if self.inited:
-            self.managers['scene'].refresh_scenes()
-            self.update_menu()
+            with self.written_lock:
+                self.written.add(normalize_path(filename))
+
+            self.refresher.schedule(filename)
+
+    @neovim.autocmd('VimLeavePre', sync=True)
+    @profiled
+    def on_vimleavepre_flush(self):
+        """Don't lose anything still waiting to be written
+        """
+
+        if self.inited:
+            self.refresher.flush()
+            if self.build_watch is not None:
+                self.build_watch.cancel()
+            self.managers['scene'].saver.flush()
+            self.session_log.writer.flush()
+            self.search_index.saver.flush()
+
+    @neovim.autocmd('InsertEnter', pattern='*.rst', eval='expand("<afile>")')
+    @profiled
+    def on_insertenter_log(self, filename):
+        """Start timing insert mode for the session log
+        """
+
+        if self.inited:
+            self.insert_started[filename] = time.time()
+
+    @neovim.autocmd('InsertLeave', pattern='*.rst', eval='expand("<afile>")')
+    @profiled
+    def on_insertleave_log(self, filename):
+        """Log the time spent in insert mode
+        """
+
+        if self.inited:
+            started = self.insert_started.pop(filename, None)
+            if started is not None:
+                self.session_log.record(filename, insert=round(time.time() - started, 1))
+
+    @neovim.command('SnowflakeStats', nargs=0)
+    @profiled
+    def show_stats(self):
+        """Show words added and time spent in insert mode by day and by file, from the session log
+        """
+
+        if not self.inited:
+            return
+
+        stats = self.session_log.stats()
+
+        def format_totals(label, totals):
+            minutes = int(totals.get('insert', 0)) // 60
+            return '  {:<30} {:>+7} words {:>4}:{:02}\n'.format(
+                label[:30], totals.get('words', 0), minutes // 60, minutes % 60)
+
+        lines = ['Snowflake stats: words added, time in insert mode\n']
+        for day in sorted(stats['days'])[-14:]:
+            lines.append(format_totals(day, stats['days'][day]))
+
+        labels = OrderedDict()
+        for scene in self.managers['scene'].scenes:
+            if scene.filename is not None:
+                labels[normalize_path(scene.filename)] = scene.title
+        for snowflake_file in self.managers['snowflake'].snowflake_files.values():
+            labels[normalize_path(snowflake_file)] = snowflake_file.rsplit(os.sep, 1)[-1]
+
+        lines.append('By file\n')
+        for filename, label in labels.items():
+            if filename in stats['files']:
+                lines.append(format_totals(label, stats['files'][filename]))
+
+        self.nvim.out_write(''.join(lines))
+
+    @neovim.command('SnowflakeSearch', nargs='+')
+    @profiled
+    def search(self, args):
+        """List the lines of the scenes and snowflake files with all the given words
+        in the quickfix list, in menu order, each one by the title of its scene
+        """
+
+        if not self.inited:
+            return
+
+        query = ' '.join(args)
+
+        # Waits for the one started at startup, or does it if that hasn't got going yet
+        self.search_index.load(self.search_files())
+
+        found = []
+        for filename, lines in self.search_index.search(query):
+            described = self.describe_file(filename)
+            if described is not None:
+                found.append((described, filename, lines))
+
+        if not found:
+            self.nvim.out_write('Snowflake: no matches for {}\n'.format(query))
+            return
+
+        found.sort()
+        items = [{'filename': filename, 'lnum': lnum, 'text': title}
+                 for (order, position, title), filename, lines in found for lnum in lines]
+
+        call_atomic(self.nvim, [
+            ('nvim_call_function', ['setqflist', [[], ' ', {'title': 'Snowflake: {}'.format(query), 'items': items}]]),
+            ('nvim_command', ['copen']),
+        ])
+
+    @neovim.command('SnowflakeProfile', nargs='*')
+    def profile(self, args):
+        """Profile the plugin's handlers: `start` and `stop` profiling, `cprofile <handler>`
+        to run its next call under cProfile, and without arguments show the report
+        """
+
+        command = args[0] if args else 'report'
+
+        if command == 'start':
+            if self.profiler is None:
+                self.profiler = Profiler(self.nvim)
+        elif command == 'stop':
+            if self.profiler is not None:
+                self.profiler.stop()
+                self.profiler = None
+        elif command == 'cprofile' and len(args) == 2:
+            if self.profiler is None:
+                self.profiler = Profiler(self.nvim)
+
+            self.profiler.capture = args[1]
+            self.nvim.out_write('Snowflake: the next {} will be written to {}\n'.format(
+                args[1], SNOWFLAKE_PROFILE.format(args[1])))
+        elif command == 'report':
+            if self.profiler is None:
+                self.nvim.out_write('Snowflake: not profiling, start with :SnowflakeProfile start\n')
+            else:
+                self.nvim.out_write('\n'.join(self.profiler.report()) + '\n')
+        else:
+            self.nvim.err_write('Snowflake: usage: SnowflakeProfile [start|stop|cprofile <handler>]\n')
 
     @neovim.autocmd('BufEnter', pattern='SnowflakeMenu', eval='expand("<afile>")', sync=True)
+    @profiled
     def enter_menu(self, filename):
         self.nvim.funcs.setpos('.', self.nvim.vars['menu_pos'])
         self.nvim.command('echom "enter menu {}"'.format(self.nvim.vars['menu_pos']))
 
     @neovim.autocmd('BufLeave', pattern='SnowflakeMenu', eval='expand("<afile>")', sync=True)
+    @profiled
     def leave_menu(self, filename):
         """BufLeave is allegedly called before leaving the buffer but actually it fucks everything
         up, because getpos('.') will return the new buffer's position.
@@ -577,12 +3426,89 @@ class SnowflakePlugin(object):
         # self.nvim.command('{} wincmd w'.format(new_win))
         # self.nvim.command('echom "to original window {}"'.format(new_win))
 
+    @profiled
+    def refresh_files(self, filenames):
+        """Refresh the scenes and word counts of `filenames` on the refresher's worker thread,
+        and have the menu updated on the main thread if anything changed. Written in Neovim
+        or not, see `Watcher`, so this may include the scene list YAML too. Only the words
+        added in Neovim are logged.
+        """
+
+        try:
+            before = dict((normalize_path(filename), self.get_counts(filename)) for filename in filenames)
+
+            with self.written_lock:
+                written = self.written & set(before)
+                self.written -= written
+
+            changed = False
+            if SNOWFLAKE_SCENES_YAML in before and self.managers['scene'].reload():
+                changed = True
+
+                # Scenes may have come and gone
+                self.search_index.update(self.search_files())
+
+            if self.managers['snowflake'].refresh_counts(filenames):
+                changed = True
+
+            if self.managers['scene'].refresh_files(filenames):
+                changed = True
+
+            if changed:
+                self.nvim.async_call(self.update_menu)
+
+            ours = [filename for filename in before if self.describe_file(filename) is not None]
+            self.search_index.update(ours)
+
+            build_watch = self.build_watch
+            if build_watch is not None and (ours or SNOWFLAKE_SCENES_YAML in before):
+                build_watch.schedule(*ours)
+
+            for filename, old in before.items():
+                if filename not in written:
+                    continue
+
+                new = self.get_counts(filename)
+                if new is not None and (old is None or new[0] != old[0]):
+                    self.session_log.record(filename, words=new[0] - (old[0] if old is not None else 0))
+        except Exception as e:
+            self.nvim.async_call(self.nvim.err_write, 'Snowflake: refresh failed: {}\n'.format(e))
+
+    def get_counts(self, filename):
+        """Return the counts of `filename` from whichever manager has it
+        """
+
+        for manager in self.managers.values():
+            counts = manager.get_counts(filename)
+            if counts is not None:
+                return counts
+
+    def describe_file(self, filename):
+        """Return (manager order, position, title) of `filename` from whichever manager has it
+        """
+
+        for order, manager in enumerate(self.managers.values()):
+            described = manager.describe_file(filename)
+            if described is not None:
+                return (order,) + tuple(described)
+
+    def search_files(self):
+        """Return the normalized filenames of everything `:SnowflakeSearch` searches
+        """
+
+        filenames = [normalize_path(filename) for filename in self.managers['snowflake'].snowflake_files.values()]
+
+        with self.managers['scene'].lock:
+            filenames.extend(self.managers['scene'].scenes.by_filename)
+
+        return filenames
+
     def load_snowflake(self):
         """Load a Snowflake file
         """
 
         with open(SNOWFLAKE_YAML, 'rb') as f:
-            self.snowflake.update(yaml.load(f.read()))
+            self.snowflake.update(yaml_load(f.read()))
 
     def check_snowflake(self):
         """Ensure the project state
@@ -600,50 +3526,66 @@ class SnowflakePlugin(object):
         """
 
         with open(SNOWFLAKE_YAML, 'wb') as f:
-            f.write(yaml.dump(self.snowflake).encode('utf-8'))
+            f.write(yaml_dump(self.snowflake))
 
+    @profiled
     def menu_stat(self):
-        """Get the current menu manager we're at
+        """Get the current menu manager and item we're at
         """
 
-        # Good thing this doesn't have to be web scale
+        _, curr_line, curr_col, _ = self.nvim.funcs.getpos('.')
 
-        curr_line = self.nvim.funcs.line('.')
-        curr_col = self.nvim.funcs.col('.')
-
-        in_manager = None
-        menu_line = None
-        for i, line in enumerate(self.menubuf):
-            if not line:
-                continue
+        # vim indexes from 1
+        if 0 < curr_line <= len(self.menu_items):
+            item = self.menu_items[curr_line - 1]
+        else:
+            item = MenuItem(None, None, None)
 
-            prefix = line[0]
-            rest = line[1:]
+        return MenuStat(item.manager, item.idx, item.kind, curr_line, curr_col)
 
-            # vim indexes from 1
-            if prefix in ('+', '-') and i <= curr_line - 1:
-                for manager in self.managers.values():
-                    if rest == manager.title:
-                        in_manager = manager
-                        menu_line = i + 1
-                        break
+    def menu_block(self, range):
+        """Return the manager of the scenes on menu lines `range`, the first menu item of
+        them and the (first, last) positions they cover, or None if there are none
+        """
 
-        offset = curr_line - menu_line
+        items = [item for item in self.menu_items[range[0] - 1:range[1]] if item.kind in ('title', 'descr', 'chapter')]
+        if not items or not callable(getattr(items[0].manager, 'block', None)):
+            return None
 
-        return MenuStat(in_manager, offset, menu_line, curr_col)
+        return items[0].manager, items[0], items[0].manager.block([(item.idx, item.kind) for item in items])
 
     def clean_windows(self):
         """Reap all windows, but leave menu and another one so
         managers can assume they have another window to go.
+        Return that other window.
         """
 
-        for window in self.nvim.windows:
-            if window.handle != self.menu_win_handle:
-                ret = self.nvim.funcs.win_gotoid(window.handle)
-                assert ret == 1
-                self.nvim.command('close!')
-            if len(self.nvim.windows) == 2:
-                break
+        windows = [window for window in self.nvim.windows if window.handle != self.menu_win_handle]
+
+        if not windows:
+            call_atomic(self.nvim, [
+                ('nvim_call_function', ['win_gotoid', [self.menu_win_handle]]),
+                ('nvim_command', ['rightbelow vsplit']),
+            ])
+            return self.nvim.current.window
+
+        if len(windows) > 1:
+            call_atomic(self.nvim, [('nvim_win_close', [window, True]) for window in windows[:-1]])
+
+        return windows[-1]
+
+    @profiled
+    def use_layout(self, manager):
+        """Clean up the windows and lay them out as `manager` wants.
+        Return the window next to the menu when there's no layout.
+        """
+
+        window = self.clean_windows()
+
+        if manager.layout is not None:
+            apply_layout(self.nvim, self.menu_win_handle, manager.layout)
+
+        return window
 
     def make_menu_pane(self):
         """Split out what will be the menu
@@ -656,58 +3598,137 @@ class SnowflakePlugin(object):
         self.nvim.command('vsplit')
 
         self.menu_win_handle = self.nvim.funcs.win_getid()
-        win_number = self.nvim.funcs.win_id2win(self.menu_win_handle)
-
-        menuwin = self.nvim.windows[win_number - 1]
-        self.menubuf = menuwin.buffer
 
         # Set a name for menu, but also make it 'nofile' later
         self.nvim.command('edit SnowflakeMenu')
 
+        self.menubuf = self.nvim.current.buffer
+        self.menu_items = [MenuItem(None, None, None)]
+        self.menu_lines = ['']
+
         # Want to deal with the tree
         self.nvim.command('nmap <silent><buffer> <Space> :call SnowflakeToggleMenu()<CR>')
         self.nvim.command('nmap <silent><buffer> L :call SnowflakeSetLayout()<CR>')
         self.nvim.command('nmap <silent><buffer> A :call SnowflakePrependScene()<CR>')
         self.nvim.command('nmap <silent><buffer> a :call SnowflakeAppendScene()<CR>')
+        self.nvim.command('nmap <silent><buffer> C :call SnowflakeAddChapter()<CR>')
         self.nvim.command('nmap <silent><buffer> o :call SnowflakeEditScene()<CR>')
         self.nvim.command('nmap <silent><buffer> K :call SnowflakeMoveScene(-1)<CR>')
         self.nvim.command('nmap <silent><buffer> J :call SnowflakeMoveScene(+1)<CR>')
+        self.nvim.command('xmap <silent><buffer> K :call SnowflakeMoveScenes(-v:count1)<CR>')
+        self.nvim.command('xmap <silent><buffer> J :call SnowflakeMoveScenes(v:count1)<CR>')
+        self.nvim.command('xmap <silent><buffer> d :call SnowflakeRemoveScenes()<CR>')
 
         self.menubuf.options['buflisted'] = False
         self.menubuf.options['buftype'] = 'nofile'
         self.menubuf.options['filetype'] = 'snowflakemenu'
 
+    @profiled
     def update_menu(self, menu_stat=None):
         """Update the menu with whatever we're currently doing.
-        Optional `menu_stat` resets the cursor location
+        Optional `menu_stat` puts the cursor on the line of its item,
+        or where it was if the item is gone.
+
+        Only what's around the visible lines, and where the cursor goes, is rendered. The
+        other lines are left as they were or blank, and rendered once scrolled to, see
+        `on_cursormoved_render()`, so how long the menu gets hardly matters.
+        """
+
+        items = [MenuItem(None, i, None) for i in range(len(MENU_HEADER))]
+        for manager in self.managers.values():
+            items.extend(MenuItem(manager, idx, kind) for idx, kind in manager.contribute_to_menu())
+
+        line = None
+        if menu_stat is not None:
+            try:
+                line = items.index(MenuItem(menu_stat.manager, menu_stat.idx, menu_stat.kind)) + 1
+            except ValueError:
+                line = min(menu_stat.line, len(items))
+
+        top, bottom = self.menu_view
+        rows = set(range(max(0, top - 1 - MENU_MARGIN), min(len(items), bottom + MENU_MARGIN)))
+        if line is not None:
+            rows.update(range(max(0, line - 1 - MENU_PAGE), min(len(items), line + MENU_PAGE)))
+
+        # Everything goes in one RPC, only sending the lines that changed
+        calls = [('nvim_buf_set_option', [self.menubuf, 'modifiable', True])]
+
+        # Lines added or removed, eg. by opening a chapter
+        lines = list(self.menu_lines)
+        for start, end, new_start, new_end in diff_lines(self.menu_items, items):
+            hunk = [self.menu_text(items[i]) if i in rows else None for i in range(new_start, new_end)]
+            lines[start:end] = hunk
+            calls.append(('nvim_buf_set_lines', [self.menubuf, start, end, False,
+                                                 [text or '' for text in hunk]]))
+
+        # Lines that stay may show something else now, eg. after a move
+        self.menu_items = items
+        self.menu_lines = [None] * len(items)
+        for row in rows:
+            self.menu_lines[row] = lines[row]
+        calls.extend(self.render_calls(sorted(rows)))
+
+        calls.extend((
+            ('nvim_buf_set_option', [self.menubuf, 'modifiable', False]),
+            ('nvim_buf_set_option', [self.menubuf, 'bufhidden', 'hide']),
+            ('nvim_buf_set_option', [self.menubuf, 'buftype', 'nofile']),
+            ('nvim_win_set_option', [self.menu_win_handle, 'number', False]),
+            ('nvim_win_set_option', [self.menu_win_handle, 'relativenumber', False]),
+            ('nvim_win_set_option', [self.menu_win_handle, 'foldcolumn', '0']),
+            ('nvim_win_set_option', [self.menu_win_handle, 'wrap', False]),
+            ('nvim_win_set_width', [self.menu_win_handle, 30]),
+        ))
+
+        if line is not None:
+            calls.append(('nvim_call_function', ['cursor', [line, menu_stat.col]]))
+
+        call_atomic(self.nvim, calls)
+
+    @neovim.autocmd('CursorMoved', pattern='SnowflakeMenu', eval='[line("w0"), line("w$")]')
+    @profiled
+    def on_cursormoved_render(self, view):
+        """Render the menu lines scrolled to since the last update
         """
 
-        win_number = self.nvim.funcs.win_id2win(self.menu_win_handle)
+        if not self.inited:
+            return
 
-        menuwin = self.nvim.windows[win_number - 1]
-        self.menubuf = menuwin.buffer
+        self.menu_view = tuple(view)
 
-        self.menubuf.options['modifiable'] = True
+        top, bottom = self.menu_view
+        rows = range(max(0, top - 1 - MENU_MARGIN), min(len(self.menu_items), bottom + MENU_MARGIN))
+        calls = self.render_calls(row for row in rows if self.menu_lines[row] is None)
 
-        self.menubuf[:] = ['']
-        self.menubuf[0] = 'MENU'
-        self.menubuf.append('====')
-        self.menubuf.append('')
+        if calls:
+            call_atomic(self.nvim, [('nvim_buf_set_option', [self.menubuf, 'modifiable', True])] + calls + [
+                ('nvim_buf_set_option', [self.menubuf, 'modifiable', False]),
+            ])
 
-        for manager in self.managers.values():
-            manager.contribute_to_menu(self.menubuf)
+    def render_calls(self, rows):
+        """Render menu lines `rows` (0-indexed, in order), and return the calls to send
+        the ones that changed, consecutive ones together
+        """
 
-        self.menubuf.options['modifiable'] = False
-        self.menubuf.options['bufhidden'] = 'hide'
-        self.menubuf.options['buftype'] = 'nofile'
+        runs = []
+        for row in rows:
+            text = self.menu_text(self.menu_items[row])
+            if text == self.menu_lines[row]:
+                continue
 
-        menuwin.options['number'] = False
-        menuwin.options['relativenumber'] = False
-        menuwin.options['foldcolumn'] = 0
-        menuwin.options['wrap'] = False
+            self.menu_lines[row] = text
+            if runs and runs[-1][1] == row:
+                runs[-1][1] += 1
+                runs[-1][2].append(text)
+            else:
+                runs.append([row, row + 1, [text]])
 
-        self.nvim.windows[win_number - 1].width = 30
+        return [('nvim_buf_set_lines', [self.menubuf, start, end, False, texts]) for start, end, texts in runs]
 
-        if menu_stat is not None:
-            self.nvim.funcs.cursor(menu_stat.line + menu_stat.offset, menu_stat.col)
+    def menu_text(self, item):
+        """Return the text of the menu line showing `item`
+        """
+
+        if item.manager is None:
+            return MENU_HEADER[item.idx]
 
+        return item.manager.menu_line(item.idx, item.kind)